@@ -17,6 +17,7 @@ from fuzzywuzzy import process, fuzz
 import re
 from sklearn.linear_model import Ridge
 import scipy.sparse as sp
+from scipy.stats import chi2_contingency, qmc
 import json
 from tqdm import tqdm
 import ast
@@ -24,7 +25,13 @@ import xgboost as xgb
 import multiprocessing
 import os
 import itertools 
-import copy
+import time
+import hashlib
+import inspect
+import threading
+import pickle
+import tempfile
+import uuid
 
 # --------------- Useful Classes, Functions & Variables ---------------
 class DatabaseManager:
@@ -111,6 +118,261 @@ class DatabaseManager:
                 cur.execute(sql, params or ())
             return cur.rowcount
 
+class ModelRegistry:
+    """
+    On-disk cache of trained XGBoost boosters so Alg does not retrain for every fixture.
+
+    Each entry is keyed by model kind, league, a fingerprint of the training data (row count, max id and column
+    sums from a cheap aggregate query) and a version of the training code (source of train_fn, which holds the
+    features and params). A booster is retrained only when one of them changes.
+
+    Usage Example:
+    booster, columns = MODEL_REGISTRY.get_or_train(
+        "context_ras", league_id,
+        "SELECT COUNT(*), MAX(detail_id) FROM match_detail",
+        None,
+        train_fn
+    )
+    MODEL_REGISTRY.stats()  # {'hits': 3, 'misses': 1, 'saved_seconds': 41.2, 'train_seconds': 13.7}
+    """
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.train_seconds = 0.0
+
+    def fingerprint(self, sql: str, params: Sequence[Any] | None = None) -> str:
+        row = DB.select(sql, params).iloc[0].tolist()
+        return hashlib.sha1(json.dumps(row, default=str).encode()).hexdigest()[:16]
+
+    def code_version(self, train_fn) -> str:
+        # A change to the features, query or params of train_fn must never be served a model trained before it
+        fn = getattr(train_fn, "__func__", train_fn)
+        try:
+            source = inspect.getsource(fn)
+        except (OSError, TypeError):
+            source = fn.__code__.co_code.hex() if hasattr(fn, "__code__") else repr(fn)
+        return hashlib.sha1(source.encode()).hexdigest()[:8]
+
+    def _paths(self, kind: str, league_id, fingerprint: str, version: str) -> tuple[str, str]:
+        base = os.path.join(self.directory, f"{kind}_{league_id if league_id is not None else 'all'}_{fingerprint}_{version}")
+        return f"{base}.json", f"{base}.meta.json"
+
+    def get_or_train(self, kind: str, league_id, fingerprint_sql: str, params, train_fn):
+        fingerprint = self.fingerprint(fingerprint_sql, params)
+        model_path, meta_path = self._paths(kind, league_id, fingerprint, self.code_version(train_fn))
+
+        if os.path.exists(model_path) and os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            booster = xgb.Booster()
+            booster.load_model(model_path)
+            with self._lock:
+                self.hits += 1
+                self.saved_seconds += meta["train_seconds"]
+            return booster, meta["columns"]
+
+        start = time.perf_counter()
+        booster, columns = train_fn()
+        elapsed = time.perf_counter() - start
+        columns = list(columns)
+
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to temp files first so a concurrent Alg never loads a half-written model. The temp model keeps the
+        # .json suffix: XGBoost picks the format from it and writes UBJSON for any other name
+        tmp_model = f"{model_path[:-len('.json')]}.{os.getpid()}.tmp.json"
+        tmp_meta  = f"{meta_path}.{os.getpid()}.tmp"
+        booster.save_model(tmp_model)
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"columns": columns, "train_seconds": elapsed, "trained_at": datetime.now().isoformat()}, f)
+        os.replace(tmp_model, model_path)
+        os.replace(tmp_meta, meta_path)
+
+        with self._lock:
+            self.misses += 1
+            self.train_seconds += elapsed
+        return booster, columns
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "saved_seconds": round(self.saved_seconds, 2), "train_seconds": round(self.train_seconds, 2)}
+
+class SimulationStore:
+    """
+    Columnar on-disk store of simulated events, one memory-mappable .npy per event kind and schedule instead of MySQL rows.
+
+    Event kinds are NumPy structured arrays (DTYPES) with players interned as indices into the team's player list,
+    which lives in a small JSON sidecar with the run summary. Every file is written to a temp name and swapped in
+    with os.replace, the sidecar last, so a reader never opens a half-written run.
+
+    Usage Example:
+    SIM_STORE.write(schedule_id, {"shots": shots, "cards": cards}, {"n_sims": 20000, "home_players": [...], "away_players": [...]})
+    meta  = SIM_STORE.read_meta(schedule_id)
+    shots = SIM_STORE.open(schedule_id, "shots")   # read-only memmap, columns are read lazily
+    goals = shots['outcome'] == 1
+    scores = SIM_STORE.open(schedule_id, "scores")   # [sim, minute 0..90, home/away] score after that minute
+    SIM_STORE.remove(schedule_id)
+    """
+    # team 0 ⇒ home; shooter -1 ⇒ not resolved (no player props), assister -1 ⇒ unassisted or not resolved
+    DTYPES = {"shots": np.dtype([('sim', np.int32), ('minute', np.int8), ('team', np.int8), ('shooter', np.int16),
+                                 ('outcome', np.int8), ('is_foot', np.int8), ('assister', np.int16)]),
+              "cards": np.dtype([('sim', np.int32), ('minute', np.int8), ('team', np.int8), ('player', np.int16),
+                                 ('is_red', np.int8)]),
+              "scores": np.dtype(np.int8)}
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def _base(self, schedule_id: int) -> str:
+        return os.path.join(self.directory, f"schedule_{int(schedule_id)}")
+
+    def write(self, schedule_id: int, arrays: dict[str, np.ndarray], meta: dict) -> None:
+        base = self._base(schedule_id)
+        os.makedirs(self.directory, exist_ok=True)
+        for kind, array in arrays.items():
+            tmp_path = f"{base}.{kind}.npy.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(array, dtype=self.DTYPES[kind]))
+            os.replace(tmp_path, f"{base}.{kind}.npy")
+
+        tmp_meta = f"{base}.meta.json.{os.getpid()}.tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(meta, f, default=str)
+        os.replace(tmp_meta, f"{base}.meta.json")
+
+    def read_meta(self, schedule_id: int) -> dict | None:
+        meta_path = f"{self._base(schedule_id)}.meta.json"
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def version(self, schedule_id: int) -> int | None:
+        # Changes whenever the run is rewritten, since the sidecar is always swapped in last
+        try:
+            return os.stat(f"{self._base(schedule_id)}.meta.json").st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def open(self, schedule_id: int, kind: str) -> np.ndarray | None:
+        path = f"{self._base(schedule_id)}.{kind}.npy"
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode="r")
+
+    def remove(self, schedule_id: int) -> None:
+        base = self._base(schedule_id)
+        for path in [f"{base}.{kind}.npy" for kind in self.DTYPES] + [f"{base}.meta.json"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+class InPlayPricer:
+    """
+    Final-score table for an in-play state (minute, score, players sent off) read from a match's stored pre-match
+    trajectories instead of a new Alg run. Each stored run is indexed once into a conditional_score_cube, so a lookup
+    is two binary searches whatever the number of sims.
+
+    The sims that were in that state at the end of the minute are a sample of the rest of the match as it stands.
+    When fewer than min_sims of them match, top_up runs n more trajectories started from the state (see
+    Alg.in_play_trajectories), meant for a worker thread since it simulates. Once it is done final_counts pools both;
+    until then final_counts prices the matched sims alone and reports how many are missing. Top-ups are memoised per
+    stored run and state.
+
+    Usage Example:
+    pricer = InPlayPricer(SIM_STORE, min_sims=1000)
+    counts, info = pricer.final_counts(schedule_id, 30, 1, 0, reds=(0, 1))
+    info   # {'matched': 412, 'top_up': 0, 'missing': 588}
+    pricer.top_up(schedule_id, 30, 1, 0, (0, 1), lambda n: alg.in_play_trajectories(n, 30, 1, 0, (0, 1)))
+    pricer.final_counts(schedule_id, 30, 1, 0, reds=(0, 1))[1]   # {'matched': 412, 'top_up': 588, 'missing': 0}
+    """
+    RUN_CACHE_SIZE = 4
+
+    def __init__(self, store: SimulationStore, min_sims: int = 1000, max_goals: int = 10, max_reds: int = 4) -> None:
+        self.store = store
+        self.min_sims = min_sims
+        self.max_goals = max_goals
+        self.max_reds = max_reds
+        self._runs = {}
+        self._top_ups = {}
+        # Top-ups look runs up from worker threads while the GUI thread prices
+        self._lock = threading.Lock()
+
+    def _run(self, schedule_id: int):
+        # Everything a state lookup needs, built once per stored run and reloaded only when the run is rewritten (a
+        # stat of the sidecar, no JSON read): version, meta, scores, sent off by minute and the conditional cubes
+        version = self.store.version(schedule_id)
+        if version is None:
+            return None
+        with self._lock:
+            return self._load_run(schedule_id, version)
+
+    def _load_run(self, schedule_id: int, version: int):
+        run = self._runs.get(schedule_id)
+        if run is None or run['version'] != version:
+            meta  = self.store.read_meta(schedule_id)
+            cards = self.store.open(schedule_id, "cards")
+            sent_off = sent_off_events(cards, (len(meta['home_players']), len(meta['away_players'])),
+                                       (np.array(meta['home_yellow_before']), np.array(meta['away_yellow_before'])))
+            scores = self.store.open(schedule_id, "scores")
+            reds = sent_off_by_minute(sent_off, len(scores), (meta.get('home_reds_before', 0), meta.get('away_reds_before', 0)))
+            run = {'version': version, 'meta': meta, 'scores': scores, 'reds': np.minimum(reds, self.max_reds), 'cubes': {}}
+            if len(self._runs) >= self.RUN_CACHE_SIZE:
+                self._runs.pop(next(iter(self._runs)))
+            self._runs[schedule_id] = run
+        return run
+
+    def _cube(self, run, to_minute: int):
+        # One cube per final minute asked for, the first lookup for it pays one pass over the stored trajectories
+        cube = run['cubes'].get(to_minute)
+        if cube is None:
+            cube = conditional_score_cube(run['scores'], run['reds'], to_minute, self.max_goals, self.max_reds)
+            run['cubes'][to_minute] = cube
+        return cube
+
+    def _top_up_key(self, run, schedule_id: int, minute: int, home_goals: int, away_goals: int, reds: tuple[int, int]) -> tuple:
+        return (schedule_id, run['version'] if run is not None else None, minute, home_goals, away_goals, tuple(reds))
+
+    def matching_sims(self, schedule_id: int, minute: int, home_goals: int, away_goals: int, reds: tuple[int, int] = (0, 0)) -> np.ndarray:
+        # Indices of the stored sims in this state; a full pass over the run, so pricing goes through the cube instead
+        run = self._run(schedule_id)
+        if run is None:
+            return np.empty(0, dtype=np.int64)
+        scores, sent = run['scores'], run['reds'][:, minute]
+        return np.flatnonzero((scores[:, minute, 0] == home_goals) & (scores[:, minute, 1] == away_goals) &
+                              (sent[:, 0] == min(reds[0], self.max_reds)) & (sent[:, 1] == min(reds[1], self.max_reds)))
+
+    def final_counts(self, schedule_id: int, minute: int, home_goals: int, away_goals: int, reds: tuple[int, int] = (0, 0), to_minute: int = 90) -> tuple[np.ndarray, dict]:
+        # Never simulates: a top-up is only pooled once top_up has stored it
+        run = self._run(schedule_id)
+        if run is None:
+            counts = np.zeros((self.max_goals + 1, self.max_goals + 1), dtype=np.int64)
+        else:
+            counts = conditional_counts(self._cube(run, to_minute), minute, home_goals, away_goals, reds)
+        matched = int(counts.sum())
+
+        missing, n_extra = 0, 0
+        if matched < self.min_sims:
+            extra = self._top_ups.get(self._top_up_key(run, schedule_id, minute, home_goals, away_goals, reds))
+            if extra is not None:
+                n_extra = len(extra)
+                capped = np.minimum(extra[:, to_minute], self.max_goals).astype(np.int64)
+                np.add.at(counts, (capped[:, 0], capped[:, 1]), 1)
+            else:
+                missing = self.min_sims - matched
+        return counts, {'matched': matched, 'top_up': n_extra, 'missing': missing}
+
+    def top_up(self, schedule_id: int, minute: int, home_goals: int, away_goals: int, reds: tuple[int, int], run_top_up) -> None:
+        # run_top_up(n) ⇒ [n, 91, 2] trajectories from the state; skipped when enough sims match or it already ran
+        sims = self.matching_sims(schedule_id, minute, home_goals, away_goals, reds)
+        if len(sims) >= self.min_sims:
+            return
+        key = self._top_up_key(self._run(schedule_id), schedule_id, minute, home_goals, away_goals, reds)
+        if key not in self._top_ups:
+            self._top_ups[key] = run_top_up(self.min_sims - len(sims))
+
 class Fill_Teams_Data:
     """
     - Fetches the fixture URL from the league_data table.
@@ -252,6 +514,91 @@ class Fill_Teams_Data:
         return fixtures_url
 
 DB = DatabaseManager(host="localhost", user="root", password="venomio", database="finaltest")
+MODEL_REGISTRY = ModelRegistry(os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_cache"))
+SIM_STORE = SimulationStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), "sim_store"))
+IN_PLAY = InPlayPricer(SIM_STORE)
+
+def card_count_distribution(cards, n_sims, max_cards=15):
+    # Cards per sim ⇒ [home, away, match] × P(k cards), the last column is "max_cards or more"
+    counts = np.bincount(np.asarray(cards['sim'], dtype=np.int64) * 2 + cards['team'], minlength=2 * n_sims).reshape(n_sims, 2)
+    counts = np.column_stack([counts, counts.sum(axis=1)])
+    return np.stack([np.bincount(np.minimum(c, max_cards), minlength=max_cards + 1) for c in counts.T]) / max(1, n_sims)
+
+def sent_off_by_minute(sent_off, n_sims, reds_before=(0, 0)):
+    # [sim, minute, home/away] ⇒ players sent off by the end of that minute, those before the simulated minutes included
+    reds = np.zeros((n_sims, 91, 2), dtype=np.int8)
+    np.add.at(reds, (sent_off['sim'], sent_off['minute'], sent_off['team']), 1)
+    np.cumsum(reds, axis=1, out=reds)
+    reds += np.asarray(reds_before, dtype=np.int8)
+    return reds
+
+def conditional_score_cube(scores, reds, to_minute=90, max_goals=10, max_reds=4):
+    # Sparse [minute, home, away, home sent off, away sent off, home at to_minute, away at to_minute] ⇒ number of sims,
+    # so every in-play market for a given state reads one [max_goals + 1, max_goals + 1] histogram (see
+    # conditional_counts). Only the occupied cells are kept, as sorted cell keys and their counts. Goals are capped at
+    # max_goals and sendings-off at max_reds
+    n_goals, n_reds = max_goals + 1, max_reds + 1
+    capped = np.minimum(scores, max_goals).astype(np.int64)
+    sent   = np.minimum(reds, max_reds).astype(np.int64)
+    state  = (((np.arange(scores.shape[1])[None, :] * n_goals + capped[:, :, 0]) * n_goals + capped[:, :, 1]) * n_reds + sent[:, :, 0]) * n_reds + sent[:, :, 1]
+    end    = capped[:, to_minute, 0] * n_goals + capped[:, to_minute, 1]
+    keys, counts = np.unique((state * n_goals ** 2 + end[:, None]).ravel(), return_counts=True)
+    return {'keys': keys, 'counts': counts, 'max_goals': max_goals, 'max_reds': max_reds}
+
+def conditional_counts(cube, minute, home_goals, away_goals, reds=(0, 0)):
+    # [home, away] final-score counts of the sims in this state, two binary searches into conditional_score_cube
+    n_goals, n_reds = cube['max_goals'] + 1, cube['max_reds'] + 1
+    home_reds, away_reds = (min(r, cube['max_reds']) for r in reds)
+    state = (((minute * n_goals + min(home_goals, n_goals - 1)) * n_goals + min(away_goals, n_goals - 1)) * n_reds + home_reds) * n_reds + away_reds
+    lo, hi = np.searchsorted(cube['keys'], [state * n_goals ** 2, (state + 1) * n_goals ** 2])
+    counts = np.zeros(n_goals ** 2, dtype=np.int64)
+    counts[cube['keys'][lo:hi] - state * n_goals ** 2] = cube['counts'][lo:hi]
+    return counts.reshape(n_goals, n_goals)
+
+def player_card_probabilities(cards, n_sims, team_sizes, yellow_before=None):
+    # P(booked) and P(sent off) per player of each team, and P(anyone is sent off). A second yellow, counting one
+    # shown before the simulated minutes, is a sending-off too
+    n_home = team_sizes[0]
+    n_players = n_home + team_sizes[1]
+    player = np.where(cards['team'] == 0, cards['player'], n_home + cards['player']).astype(np.int64)
+    key = np.asarray(cards['sim'], dtype=np.int64) * n_players + player
+    is_red = np.asarray(cards['is_red']) == 1
+
+    booked = np.unique(key)
+    yellows, n_yellows = np.unique(key[~is_red], return_counts=True)
+    if yellow_before is not None:
+        n_yellows = n_yellows + np.concatenate(yellow_before)[yellows % n_players]
+    sent_off = np.union1d(key[is_red], yellows[n_yellows >= 2])
+
+    booked_p   = np.bincount(booked % n_players, minlength=n_players) / max(1, n_sims)
+    sent_off_p = np.bincount(sent_off % n_players, minlength=n_players) / max(1, n_sims)
+    return {'booked': [booked_p[:n_home], booked_p[n_home:]],
+            'sent_off': [sent_off_p[:n_home], sent_off_p[n_home:]],
+            'any_sent_off': len(np.unique(sent_off // n_players)) / max(1, n_sims)}
+
+def sent_off_events(cards, team_sizes, yellow_before=None):
+    # (sim, team, minute) of every sending-off: straight reds and the yellow that makes two, counting one shown
+    # before the simulated minutes
+    n_home = team_sizes[0]
+    n_players = n_home + team_sizes[1]
+    player = np.where(cards['team'] == 0, cards['player'], n_home + cards['player']).astype(np.int64)
+    key    = np.asarray(cards['sim'], dtype=np.int64) * n_players + player
+    minute = np.asarray(cards['minute'], dtype=np.int64)
+    is_red = np.asarray(cards['is_red']) == 1
+
+    order = np.lexsort((minute, key))
+    key, minute, is_red, player = key[order], minute[order], is_red[order], player[order]
+
+    # Running yellow count per player and sim, as the cards are sorted by player key then minute
+    yellows = np.flatnonzero(~is_red)
+    n_yellows = np.arange(len(yellows)) - np.searchsorted(key[yellows], key[yellows]) + 1
+    if yellow_before is not None:
+        n_yellows = n_yellows + np.concatenate(yellow_before)[player[yellows]]
+    sent = is_red.copy()
+    sent[yellows[n_yellows >= 2]] = True
+
+    keys, first = np.unique(key[sent], return_index=True)
+    return {'sim': keys // n_players, 'team': (keys % n_players >= n_home).astype(np.int64), 'minute': minute[sent][first]}
 
 def get_team_name_by_id(team_id):
     query = "SELECT team_name FROM team_data WHERE team_id = %s"
@@ -1607,7 +1954,7 @@ class RemoveOldData:
             print("No teams found. Skipping deletion.")
 
         select_deleted_data_query = """
-        SELECT match_id FROM schedule_data
+        SELECT match_id, schedule_id FROM schedule_data
         WHERE match_date < %s
         """
         
@@ -1624,12 +1971,9 @@ class RemoveOldData:
             
             self.db.execute(delete_schedule_query, tuple(match_ids_list))
 
-            delete_sim_query = f"""
-            DELETE FROM simulation_data 
-            WHERE match_id IN ({ids_placeholders})
-            """
-            
-            self.db.execute(delete_sim_query, tuple(match_ids_list))
+            # simulation_runs rows go with their schedule (ON DELETE CASCADE), the stored events are files
+            for schedule_id in match_ids_df["schedule_id"].tolist():
+                SIM_STORE.remove(schedule_id)
 
 # ------------------------------ Process data ------------------------------
 class Process_Data:
@@ -2077,8 +2421,317 @@ class Process_Data:
         DB.execute(sql)
 
 # ------------------------------ Monte Carlo ------------------------------
+class PlayerTable:
+    """
+    Struct-of-arrays view of one team's players_data for the simulation hot path.
+
+    Players are addressed by integer index (starters first, then subs) and lineups are index arrays or
+    boolean masks over those indices, so team aggregates become sums and dot products. Built once per
+    match in Alg.__init__; every array is read-only so sims and workers can share it.
+
+    Usage Example:
+    table = PlayerTable(players_data, starters, subs, yc_prob_given_foul=0.14, rc_prob_given_foul=0.005)
+    team_ras = table.off_coefs[lineup].sum(axis=0)   # off_sh, off_headers, off_footers, off_hxg, off_fxg
+    table.player_ids[table.index['player-name']]
+    """
+    COEF_TYPES = ['sh', 'headers', 'footers', 'hxg', 'fxg']
+    STATUS_COLUMNS = ['Leading', 'Level', 'Trailing']
+    FIXED_POINT = 2 ** 32
+
+    def __init__(self, players_data, starters, subs, yc_prob_given_foul, rc_prob_given_foul, k: int = 10):
+        self.player_ids = list(starters) + list(subs)
+        self.index      = {p: i for i, p in enumerate(self.player_ids)}
+        self.n          = len(self.player_ids)
+
+        def _col(key):
+            return np.array([float(players_data[p].get(key, 0) or 0) for p in self.player_ids])
+
+        def _status(key):
+            return np.array([[players_data[p][key][s] for s in self.STATUS_COLUMNS] for p in self.player_ids]).reshape(self.n, 3)
+
+        self.starters   = np.arange(len(starters))
+        self.subs       = np.arange(len(starters), self.n)
+        self.starter    = np.arange(self.n) < len(starters)
+        self.bench      = ~self.starter
+        self.sim_yellow = np.array([int(players_data[p]['sim_yellow']) for p in self.player_ids], dtype=int)
+        self.sim_red    = np.array([bool(players_data[p]['sim_red']) for p in self.player_ids], dtype=bool)
+
+        self.off_coefs = np.column_stack([_col(f'off_{c}_coef') for c in self.COEF_TYPES]).reshape(self.n, 5)
+        self.def_coefs = np.column_stack([_col(f'def_{c}_coef') for c in self.COEF_TYPES]).reshape(self.n, 5)
+
+        self.minutes_played = _col('minutes_played')
+        per_min = np.maximum(1, self.minutes_played)
+        self.headers_rate              = _col('headers') / per_min
+        self.footers_rate              = _col('footers') / per_min
+        self.non_assisted_footers_rate = _col('non_assisted_footers') / per_min
+        self.key_passes_rate           = _col('key_passes') / per_min
+
+        fouls = _col('fouls_committed')
+        self.fouls_committed_rate = fouls / per_min
+        self.fouls_committed_90   = self.fouls_committed_rate * 90
+        self.fouls_drawn_90       = _col('fouls_drawn') / per_min * 90
+
+        # Per-player terms of the running Lineup sums in fixed point: off coefs, def coefs, fouls committed/drawn per 90
+        self.lineup_terms = np.round(np.column_stack([self.off_coefs, self.def_coefs, self.fouls_committed_90, self.fouls_drawn_90]) * self.FIXED_POINT).astype(np.int64)
+
+        # Card split per foul, shrunk towards the referee's rates (see Alg.determine_card)
+        player_yc_rate = (_col('yellow_cards') + k * yc_prob_given_foul) / (fouls + k)
+        player_rc_rate = (_col('red_cards')    + k * rc_prob_given_foul) / (fouls + k)
+        yc_prob = 0.5 * player_yc_rate + 0.5 * yc_prob_given_foul
+        rc_prob = 0.5 * player_rc_rate + 0.5 * rc_prob_given_foul
+        total = np.maximum(1.0, yc_prob + rc_prob)
+        self.yc_prob = np.maximum(yc_prob / total, 0.0)
+        self.rc_prob = np.maximum(rc_prob / total, 0.0)
+
+        self.in_status_prob  = _status('in_status_prob')
+        self.out_status_prob = _status('out_status_prob')
+
+        # Shot quality only varies with these inputs, so players sharing them share psxg entries.
+        # The assister profile has one extra slot (index n) for unassisted shots.
+        shooter_keys  = list(zip(_col('sq'), _col('shooter_A')))
+        assister_keys = list(_col('sq')) + [0.0]
+        self.shooter_profiles  = list(dict.fromkeys(shooter_keys))
+        self.assister_profiles = list(dict.fromkeys(assister_keys))
+        self.shooter_profile   = np.array([self.shooter_profiles.index(k) for k in shooter_keys], dtype=int)
+        self.assister_profile  = np.array([self.assister_profiles.index(k) for k in assister_keys], dtype=int)
+
+        for value in vars(self).values():
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+
+class Lineup:
+    """
+    Players on the pitch for one team, with the team sums used by get_teams_ra and the foul model kept up to date
+    as players come and go: a substitution or sending-off costs O(changed players) instead of a full re-sum.
+
+    Sums are integers over PlayerTable.lineup_terms, so they are exact: the same set of players always gives the
+    same totals, whatever order they arrived in.
+
+    Usage Example:
+    lineup = Lineup(table, table.starters.tolist())
+    lineup.swap([3], [14])
+    lineup.off_coefs        # off_sh, off_headers, off_footers, off_hxg, off_fxg summed over the lineup
+    """
+    def __init__(self, table, players):
+        self.table   = table
+        self.players = list(players)
+        self.key     = frozenset(self.players)
+        self._sums   = table.lineup_terms[self.players].sum(axis=0)
+
+    def __contains__(self, player):
+        return player in self.key
+
+    def __len__(self):
+        return len(self.players)
+
+    def remove(self, player):
+        self.players.remove(player)
+        self.key    = frozenset(self.players)
+        self._sums  = self._sums - self.table.lineup_terms[player]
+
+    def swap(self, players_out, players_in):
+        players_out = set(players_out)
+        self.players = [p for p in self.players if p not in players_out] + list(players_in)
+        self.key     = frozenset(self.players)
+        self._sums   = self._sums - self.table.lineup_terms[list(players_out)].sum(axis=0) + self.table.lineup_terms[list(players_in)].sum(axis=0)
+
+    @property
+    def off_coefs(self):
+        return self._sums[0:5] / PlayerTable.FIXED_POINT
+
+    @property
+    def def_coefs(self):
+        return self._sums[5:10] / PlayerTable.FIXED_POINT
+
+    @property
+    def fouls_committed_90(self):
+        return self._sums[10] / PlayerTable.FIXED_POINT
+
+    @property
+    def fouls_drawn_90(self):
+        return self._sums[11] / PlayerTable.FIXED_POINT
+
+class AliasSampler:
+    """
+    Walker/Vose alias table over a discrete distribution: O(n) to build, O(1) per draw from one uniform.
+
+    Zero-weight distributions fall back to uniform, like the _normalise helpers in Alg.
+
+    Usage Example:
+    sampler = AliasSampler([0.5, 0.3, 0.2], outcomes=['h1', 'h7', None])
+    sampler.draw(np.random.rand())  # 'h1', 'h7' or None
+    """
+    def __init__(self, weights, outcomes=None):
+        weights = np.asarray(weights, dtype=float)
+        n = len(weights)
+        total = weights.sum()
+        scaled = (weights / total if total > 0 else np.full(n, 1.0 / n)) * n
+
+        prob  = [1.0] * n
+        alias = list(range(n))
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+
+        self.n        = n
+        self.prob     = prob
+        self.alias    = alias
+        self.outcomes = list(range(n)) if outcomes is None else list(outcomes)
+
+    def draw(self, u):
+        x = u * self.n
+        i = min(int(x), self.n - 1)
+        return self.outcomes[i] if x - i < self.prob[i] else self.outcomes[self.alias[i]]
+
+class EventBuffer:
+    """
+    Simulated events as a NumPy structured array, filled in preallocated blocks instead of a list of Python tuples.
+
+    The dtype is the event kind's SimulationStore.DTYPES entry, so players are interned indices and flags are one
+    byte. append writes one row in place (the per-sim engines), extend writes whole columns (the batch engine);
+    a new block is only allocated when the current one is full, and array() joins them once at the end.
+
+    Usage Example:
+    shots = EventBuffer(SimulationStore.DTYPES['shots'])
+    shots.append((sim, minute, team, shooter, outcome, is_foot, assister))
+    shots.extend(sims, minutes, teams, shooters, outcomes, is_foot, assisters)
+    records = shots.array()   # structured array, records['sim'], records['outcome'], ...
+    """
+    def __init__(self, dtype, block_size=4096):
+        self.dtype      = np.dtype(dtype)
+        self.block_size = block_size
+        self._blocks    = []
+        self._block     = np.empty(block_size, dtype=self.dtype)
+        self._fill      = 0
+
+    def __len__(self) -> int:
+        return len(self._blocks) * self.block_size + self._fill
+
+    def _next_block(self):
+        self._blocks.append(self._block)
+        self._block = np.empty(self.block_size, dtype=self.dtype)
+        self._fill  = 0
+
+    def append(self, row):
+        if self._fill == self.block_size:
+            self._next_block()
+        self._block[self._fill] = row
+        self._fill += 1
+
+    def extend(self, *columns):
+        k = len(columns[0])
+        done = 0
+        while done < k:
+            if self._fill == self.block_size:
+                self._next_block()
+            m = min(k - done, self.block_size - self._fill)
+            rows = self._block[self._fill:self._fill + m]
+            for name, col in zip(self.dtype.names, columns):
+                rows[name] = col[done:done + m]
+            self._fill += m
+            done += m
+
+    def array(self) -> np.ndarray:
+        return np.concatenate(self._blocks + [self._block[:self._fill]])
+
+class RandomStream:
+    """
+    Buffered random number stream for the simulation engines.
+
+    Uniforms are drawn from a numpy Generator in large blocks and handed out one at a time, which avoids the per-call
+    overhead of the global np.random functions. Poisson counts are drawn by inversion from a single uniform, so every
+    random decision in a simulation consumes the same stream.
+
+    Usage Example:
+    stream = RandomStream(np.random.SeedSequence(42))
+    stream.uniform()        # 0.773...
+    stream.poisson(0.12)    # 0
+    stream.uniforms(3)      # array of 3 uniforms
+    """
+    def __init__(self, seed=None, block_size=65536):
+        self.generator  = np.random.default_rng(seed)
+        self.block_size = block_size
+        self._block     = []
+        self._pos       = 0
+
+    def _refill(self):
+        self._block = self.generator.random(self.block_size).tolist()
+        self._pos   = 0
+
+    def uniform(self):
+        if self._pos >= len(self._block):
+            self._refill()
+        u = self._block[self._pos]
+        self._pos += 1
+        return u
+
+    def uniforms(self, n):
+        out = np.empty(n)
+        filled = 0
+        while filled < n:
+            if self._pos >= len(self._block):
+                self._refill()
+            take = min(n - filled, len(self._block) - self._pos)
+            out[filled:filled + take] = self._block[self._pos:self._pos + take]
+            self._pos += take
+            filled    += take
+        return out
+
+    def poisson(self, lam):
+        if lam <= 0:
+            return 0
+        return self._poisson_inverse(lam, self.uniform())
+
+    def poisson_positive(self, lam):
+        # Poisson(lam) conditioned on at least one event: inversion from a uniform above P(0)
+        p0 = math.exp(-lam)
+        return max(1, self._poisson_inverse(lam, p0 + self.uniform() * (1 - p0)))
+
+    def empty_minutes(self, rate):
+        # Whole minutes before the first one with at least one Poisson(rate) event (geometric by inversion)
+        if rate <= 0:
+            return math.inf
+        return int(math.log(1.0 - self.uniform()) / -rate)
+
+    def _poisson_inverse(self, lam, u):
+        k = 0
+        p = math.exp(-lam)
+        cdf = p
+        while u > cdf and p > 0:
+            k += 1
+            p *= lam / k
+            cdf += p
+        return k
+
 class Alg:
-    def __init__(self, schedule_id, home_team_id, away_team_id, home_players_data, away_players_data, league_id, match_time, home_elevation_dif, away_elevation_dif, away_travel, home_rest_days, away_rest_days, temperature, is_raining, home_initial_goals, away_initial_goals, match_initial_time, home_n_subs_avail, away_n_subs_avail, referee_name):
+    STATUS_VALUES = [-1.5, -1, 0, 1, 1.5]
+    STATUS_VALUES_ARR = np.array(STATUS_VALUES)
+    SAMPLER_CACHE_SIZE = 4096
+    # Model predictions are single floats, one psxg table holds a few hundred of them
+    PREDICTION_CACHE_SIZE = 64 * SAMPLER_CACHE_SIZE
+    CHUNK_SIZE = {"loop": 500, "events": 500, "vectorized": 2000, "vectorized_goals": 2000}
+    # A chunk is one Sobol' point set, which is only balanced at a power of two
+    SOBOL_CHUNK_SIZE = 2048
+    # exact_score_distribution: substitution pick orders enumerated exactly, else sampled
+    EXACT_SWAP_ORDERINGS = 100_000
+    SWAP_SAMPLES = 20_000
+    # sobol and stratified are for sampling_benchmark and offline runs: the adaptive stopping's standard error and ESS
+    # assume independent sims, so they do not describe the error of a QMC run
+    SAMPLINGS = ("random", "sobol", "stratified")
+    MIN_SIMS = 2000
+    MAX_GOALS = 10
+    TOP_SCORES = 5
+    WORKER_LOCAL_STATE = ('stream', 'player_probs_cache', 'fouler_sampler_cache', 'service', 'on_progress')
+    # Warm caches a worker setup carries; every Alg built from one fills its own copies
+    WORKER_CACHES = ('rsq_pred_cache', 'psxg_pred_cache', 'psxg_table_cache', 'lineup_state_cache', 'foul_prob_cache')
+    SHOT_DTYPE = SimulationStore.DTYPES['shots']
+    CARD_DTYPE = SimulationStore.DTYPES['cards']
+
+    def __init__(self, schedule_id, home_team_id, away_team_id, home_players_data, away_players_data, league_id, match_time, home_elevation_dif, away_elevation_dif, away_travel, home_rest_days, away_rest_days, temperature, is_raining, home_initial_goals, away_initial_goals, match_initial_time, home_n_subs_avail, away_n_subs_avail, referee_name, engine="loop", seed=None, service=None, sim_tolerance=0.005, max_sims=20000, player_props=True, antithetic=False, sampling="random", on_progress=None):
         self.schedule_id = schedule_id
         self.home_team_id = home_team_id
         self.away_team_id = away_team_id
@@ -2099,13 +2752,53 @@ class Alg:
         self.home_n_subs_avail = home_n_subs_avail
         self.away_n_subs_avail = away_n_subs_avail
         self.referee_name = referee_name
-        self.ras_booster, self.ras_cr_columns = self.train_context_ras_model()
+        self.engine = engine
+        self.seed   = seed
+        self.service = service
+        self.sim_tolerance = sim_tolerance
+        self.max_sims      = max_sims
+        self.player_props  = player_props
+        self.antithetic    = antithetic
+        self.sampling      = sampling
+        self.on_progress   = on_progress
+        self.stream = RandomStream()
+        self.ras_booster, self.ras_cr_columns = MODEL_REGISTRY.get_or_train(
+            "context_ras", self.league_id,
+            """
+            SELECT COUNT(*) AS n_rows, MAX(md.detail_id) AS max_id, MAX(mi.match_id) AS max_match,
+                   SUM(md.teamA_pdras + md.teamB_pdras) AS pdras, SUM(md.minutes_played) AS minutes
+            FROM match_info mi
+            JOIN match_detail md ON mi.match_id = md.match_id
+            WHERE mi.league_id = %s
+            """, (self.league_id,),
+            self.train_context_ras_model)
         self.ctx_mult_home, self.ctx_mult_away = self.precompute_ctx_multipliers()
-        self.rsq_booster, self.rsq_columns = self.train_refined_sq_model()
+        self.rsq_booster, self.rsq_columns = MODEL_REGISTRY.get_or_train(
+            "refined_sq", None,
+            """
+            SELECT COUNT(*) AS n_rows, MAX(shot_id) AS max_id,
+                   SUM(total_plsqa) AS plsqa, SUM(shooter_sq) AS shooter_sq, SUM(assister_sq) AS assister_sq
+            FROM shots_data
+            WHERE total_plsqa IS NOT NULL
+            """, None,
+            self.train_refined_sq_model)
         self.rsq_pred_cache = {}
         self.rsq_col_idx    = {c: i for i, c in enumerate(self.rsq_columns)}
-        self.psxg_booster, self.psxg_columns = self.train_post_shot_goal_model()
+        self.psxg_booster, self.psxg_columns = MODEL_REGISTRY.get_or_train(
+            "post_shot_goal", None,
+            """
+            SELECT COUNT(*) AS n_rows, MAX(sd.shot_id) AS max_id,
+                   SUM(sd.RSQ) AS rsq, SUM(sd.shooter_A) AS shooter_a, SUM(sd.GK_A) AS gk_a
+            FROM shots_data sd
+            JOIN match_info mi ON mi.match_id = sd.match_id
+            """, None,
+            self.train_post_shot_goal_model)
         self.psxg_pred_cache = {}
+        self.player_probs_cache = {}
+        self.lineup_state_cache  = {}
+        self.psxg_table_cache    = {}
+        self.lineup_state_hits   = 0
+        self.lineup_state_misses = 0
         self.psg_col_idx     = {c: i for i, c in enumerate(self.psxg_columns)}
         self.ref_stats = self.get_referee_stats()
         self.precompute_card_sim_data()
@@ -2116,70 +2809,41 @@ class Alg:
         self.home_players_data = self.get_players_data(self.home_team_id, self.home_starters, self.home_subs)
         self.away_players_data = self.get_players_data(self.away_team_id, self.away_starters, self.away_subs)
 
-        self._base_home_players_data = copy.deepcopy(self.home_players_data)
-        self._base_away_players_data = copy.deepcopy(self.away_players_data)
+        self.home_table = PlayerTable(self.home_players_data, self.home_starters, self.home_subs, self.yc_prob_given_foul, self.rc_prob_given_foul)
+        self.away_table = PlayerTable(self.away_players_data, self.away_starters, self.away_subs, self.yc_prob_given_foul, self.rc_prob_given_foul)
 
         self.home_sub_minutes, self.away_sub_minutes = self.get_sub_minutes(self.home_team_id, self.away_team_id, self.match_initial_time, self.home_n_subs_avail, self.away_n_subs_avail)
         self.all_sub_minutes = list(set(list(self.home_sub_minutes.keys()) + list(self.away_sub_minutes.keys())))
-
-        if self.match_initial_time >= 45:
-            range_value = 2000
-        elif self.match_initial_time < 45:
-            range_value = 8000
-        elif self.match_initial_time < 1:
-            range_value = 20000
-
-        shot_rows, card_rows = self.run_simulations(range_value, 4)
-        self.insert_sim_data(shot_rows, self.schedule_id)
-
-    def _simulate_single(self, i):
-        self.home_players_data = copy.deepcopy(self._base_home_players_data)
-        self.away_players_data = copy.deepcopy(self._base_away_players_data)
+        self.scheduled_minutes = sorted(set([16, 31, 46, 61, 76] + self.all_sub_minutes))
+
+        shots, cards = self.run_simulations(self.max_sims, 4, self.engine, self.seed, self.service, self.sim_tolerance, self.on_progress)
+        self.save_sim_events(shots, cards, self.schedule_id)
+        self.insert_sim_run(self.schedule_id)
+
+    def _simulate_single(self, i, shots, cards, event_driven=False):
+        # Player tables are shared and read-only; the only per-sim player state is the card overlay.
+        # Rows go straight into the chunk's EventBuffers as compact indices (team 0 ⇒ home, assister == table.n ⇒
+        # unassisted).
+        # event_driven jumps over minutes without shots or fouls; rates only change at context changes, so the
+        # gap is geometric and the first busy minute's counts are a multinomial split of a truncated Poisson.
+        # Without player props every shot is kept but only goals keep a shooter and assister (-1 otherwise). Shots are
+        # still drawn in full here: a per-lineup goal model costs more than the draws, since most sims' lineups are
+        # their own. Goal-only runs go to the vectorized_goals batch engine
+        detailed = self.player_props
+        home_yellow, home_red = self.home_table.sim_yellow.copy(), self.home_table.sim_red.copy()
+        away_yellow, away_red = self.away_table.sim_yellow.copy(), self.away_table.sim_red.copy()
 
         home_goals = self.home_initial_goals
         away_goals = self.away_initial_goals
-        home_active_players  = self.home_starters.copy()
-        away_active_players  = self.away_starters.copy()
-        home_passive_players = self.home_subs.copy()
-        away_passive_players = self.away_subs.copy()
-
-        shot_rows = []
-        card_rows = []
-
-        home_status, away_status = self.get_status(home_goals, away_goals)
-        time_segment = self.get_time_segment(self.match_initial_time)
-
-        home_ras, home_rahs, home_rafs, home_plhsq, home_plfsq = self.get_teams_ra(home_active_players, away_active_players, self.home_players_data, self.away_players_data)
-        away_ras, away_rahs, away_rafs, away_plhsq, away_plfsq = self.get_teams_ra(away_active_players, home_active_players, self.away_players_data, self.home_players_data)
-        home_players_prob = self.build_player_probs(home_active_players, self.home_players_data)
-        away_players_prob = self.build_player_probs(away_active_players, self.away_players_data)
-
-        home_mult = self.ctx_mult_home[(home_status, time_segment, 0)]
-        away_mult = self.ctx_mult_away[(away_status, time_segment, 0)]
-        home_context_ras = max(0, home_ras) * home_mult
-        away_context_ras = max(0, away_ras) * away_mult
-
-        home_psxg_cache = self.build_psxg_cache(home_active_players, self.home_players_data,
-                                                home_plhsq, home_plfsq,
-                                                home_status,  0,
-                                                True, self.away_players_data)
-        away_psxg_cache = self.build_psxg_cache(away_active_players, self.away_players_data,
-                                                away_plhsq, away_plfsq,
-                                                away_status, 0,
-                                                False, self.home_players_data)
-        
-        home_foul_p = self.get_team_foul_prob(home_active_players,
-                                                away_active_players,
-                                                home_status,
-                                                is_home=True)
-
-        away_foul_p = self.get_team_foul_prob(away_active_players,
-                                                home_active_players,
-                                                away_status,
-                                                is_home=False)
-
-        context_ras_change = False
-        for minute in range(self.match_initial_time, 91):
+        home_active_players  = Lineup(self.home_table, self.home_table.starters.tolist())
+        away_active_players  = Lineup(self.away_table, self.away_table.starters.tolist())
+        home_passive_players = self.home_table.subs.tolist()
+        away_passive_players = self.away_table.subs.tolist()
+
+        # The first minute builds the lineup state like any other context change
+        context_ras_change = True
+        minute = self.match_initial_time
+        while minute <= 90:
             home_status, away_status = self.get_status(home_goals, away_goals)
             time_segment = self.get_time_segment(minute)
             if minute in [16, 31, 46, 61, 76]:
@@ -2188,124 +2852,809 @@ class Alg:
             if minute in self.all_sub_minutes:
                 context_ras_change = True
                 if minute in list(self.home_sub_minutes.keys()):
-                    home_active_players, home_passive_players = self.swap_players(home_active_players, home_passive_players, self.home_players_data, self.home_sub_minutes[minute], home_status)
+                    home_active_players, home_passive_players = self.swap_players(home_active_players, home_passive_players, self.home_table, self.home_sub_minutes[minute], home_status)
                 if minute in list(self.away_sub_minutes.keys()):
-                    away_active_players, away_passive_players = self.swap_players(away_active_players, away_passive_players, self.away_players_data, self.away_sub_minutes[minute], away_status)
-                home_ras, home_rahs, home_rafs, home_plhsq, home_plfsq = self.get_teams_ra(home_active_players, away_active_players, self.home_players_data, self.away_players_data)
-                away_ras, away_rahs, away_rafs, away_plhsq, away_plfsq = self.get_teams_ra(away_active_players, home_active_players, self.away_players_data, self.home_players_data)
-                home_players_prob = self.build_player_probs(home_active_players, self.home_players_data)
-                away_players_prob = self.build_player_probs(away_active_players, self.away_players_data)
+                    away_active_players, away_passive_players = self.swap_players(away_active_players, away_passive_players, self.away_table, self.away_sub_minutes[minute], away_status)
 
             if context_ras_change:
                 context_ras_change = False
-                home_mult = self.ctx_mult_home[(home_status, time_segment, 0)]
-                away_mult = self.ctx_mult_away[(away_status, time_segment, 0)]
-                home_context_ras = max(0, home_ras) * home_mult
-                away_context_ras = max(0, away_ras) * away_mult
-
-                home_psxg_cache = self.build_psxg_cache(home_active_players, self.home_players_data,
-                                                    home_plhsq, home_plfsq,
-                                                    home_status,  0,
-                                                    True, self.away_players_data)
-                away_psxg_cache = self.build_psxg_cache(away_active_players, self.away_players_data,
-                                                    away_plhsq, away_plfsq,
-                                                    away_status, 0,
-                                                    False, self.home_players_data)
-                
-                home_foul_p = self.get_team_foul_prob(home_active_players,
-                                                        away_active_players,
-                                                        home_status,
-                                                        is_home=True)
-
-                away_foul_p = self.get_team_foul_prob(away_active_players,
-                                                        home_active_players,
-                                                        away_status,
-                                                        is_home=False)
-
-            home_shots = np.random.poisson(home_context_ras)
-            away_shots = np.random.poisson(away_context_ras)
+                # Red cards change the lineup too, so the state is looked up again on every context change
+                home_state, away_state = self.get_lineup_state(home_active_players, away_active_players, home_status, away_status, time_segment)
+                home_context_ras, home_rahs, home_rafs, home_players_prob, home_psxg, home_foul_p = home_state
+                away_context_ras, away_rahs, away_rafs, away_players_prob, away_psxg, away_foul_p = away_state
+
+            if event_driven:
+                rates = (home_context_ras, away_context_ras, home_foul_p, away_foul_p)
+                next_change = self.next_scheduled_minute(minute)
+                skip = self.stream.empty_minutes(sum(rates))
+                if minute + skip >= next_change:
+                    minute = next_change
+                    continue
+                minute += skip
+                home_shots, away_shots, home_fouls, away_fouls = self._split_events(self.stream.poisson_positive(sum(rates)), rates)
+            else:
+                home_shots = self.stream.poisson(home_context_ras)
+                away_shots = self.stream.poisson(away_context_ras)
+                home_fouls = self.stream.poisson(home_foul_p)
+                away_fouls = self.stream.poisson(away_foul_p)
 
             if home_shots:
                 for _ in range(home_shots):
                     body_part = self.get_shot_type(home_rahs, home_rafs)
                     shooter = self.get_shooter(home_players_prob, body_part)
                     assister = self.get_assister(home_players_prob, body_part, shooter)
-                    xg_prob   = home_psxg_cache.get((shooter, assister, body_part), 0.0)
-                    outcome = int(np.random.rand() < xg_prob)
+                    xg_prob   = self.get_xg_prob(home_psxg, self.home_table, shooter, assister, body_part)
+                    outcome = int(self.stream.uniform() < xg_prob)
                     if outcome == 1:
                         home_goals += 1
                         context_ras_change = True
-                    shot_rows.append((i, minute, shooter, self.home_team_id, outcome, body_part, assister))
+                    if outcome == 0 and not detailed:
+                        shooter, assister = -1, -1
+                    shots.append((i, minute, 0, shooter, outcome, body_part == 'Foot', self.home_table.n if assister is None else assister))
 
             if away_shots:
                 for _ in range(away_shots):
                     body_part = self.get_shot_type(away_rahs, away_rafs)
                     shooter = self.get_shooter(away_players_prob, body_part)
                     assister = self.get_assister(away_players_prob, body_part, shooter)
-                    xg_prob   = away_psxg_cache.get((shooter, assister, body_part), 0.0)
-                    outcome = int(np.random.rand() < xg_prob) 
+                    xg_prob   = self.get_xg_prob(away_psxg, self.away_table, shooter, assister, body_part)
+                    outcome = int(self.stream.uniform() < xg_prob)
                     if outcome == 1:
                         away_goals += 1
                         context_ras_change = True
-                    shot_rows.append((i, minute, shooter, self.away_team_id, outcome, body_part, assister))  
+                    if outcome == 0 and not detailed:
+                        shooter, assister = -1, -1
+                    shots.append((i, minute, 1, shooter, outcome, body_part == 'Foot', self.away_table.n if assister is None else assister))
 
 
-            home_fouls = np.random.poisson(home_foul_p)
             for _ in range(home_fouls):
-                fouler     = self.choose_fouler(home_active_players, self.home_players_data)
-                card_type  = self.determine_card(fouler, self.home_players_data)
+                fouler     = self.choose_fouler(home_active_players)
+                card_type  = self.determine_card(fouler, self.home_table)
                 if card_type != 'NONE':
-                    card_rows.append((i, minute, fouler, self.home_team_id, card_type))
+                    cards.append((i, minute, 0, fouler, card_type == 'RC'))
                 if card_type == 'YC':
-                    self.home_players_data[fouler]['sim_yellow'] += 1
-                    if self.home_players_data[fouler]['sim_yellow'] >= 2:
+                    home_yellow[fouler] += 1
+                    if home_yellow[fouler] >= 2:
                         home_active_players.remove(fouler)
                         context_ras_change = True
                 elif card_type == 'RC':
-                    self.home_players_data[fouler]['sim_red'] = True
+                    home_red[fouler] = True
                     if fouler in home_active_players:
                         home_active_players.remove(fouler)
                         context_ras_change = True
 
-            away_fouls = np.random.poisson(away_foul_p)
             for _ in range(away_fouls):
-                fouler     = self.choose_fouler(away_active_players, self.away_players_data)
-                card_type  = self.determine_card(fouler, self.away_players_data)
+                fouler     = self.choose_fouler(away_active_players)
+                card_type  = self.determine_card(fouler, self.away_table)
                 if card_type != 'NONE':
-                    card_rows.append((i, minute, fouler, self.away_team_id, card_type))
+                    cards.append((i, minute, 1, fouler, card_type == 'RC'))
                 if card_type == 'YC':
-                    self.away_players_data[fouler]['sim_yellow'] += 1
-                    if self.away_players_data[fouler]['sim_yellow'] >= 2:
+                    away_yellow[fouler] += 1
+                    if away_yellow[fouler] >= 2:
                         away_active_players.remove(fouler)
                         context_ras_change = True
                 elif card_type == 'RC':
-                    self.away_players_data[fouler]['sim_red'] = True
+                    away_red[fouler] = True
                     if fouler in away_active_players:
                         away_active_players.remove(fouler)
                         context_ras_change = True
-        return shot_rows, card_rows
+            minute += 1
+
+    def next_scheduled_minute(self, minute):
+        # First minute after this one where the loop refreshes rates regardless of events (segment or substitution), else
+        # full time. A team without subs left has the {100: 0} sentinel in its sub minutes, which must not outlast minute 90
+        later = [m for m in self.scheduled_minutes if m > minute]
+        return min(later[0], 91) if later else 91
+
+    def _split_events(self, n_events, rates):
+        # Multinomial split of n_events over (home shots, away shots, home fouls, away fouls), one uniform per event
+        total  = sum(rates)
+        counts = [0, 0, 0, 0]
+        for _ in range(n_events):
+            u = self.stream.uniform() * total
+            k = 0
+            while k < 3 and u >= rates[k]:
+                u -= rates[k]
+                k += 1
+            counts[k] += 1
+        return counts
+
+    def simulate_chunk(self, engine, start, n_sims, seed):
+        # Every chunk owns a stream spawned from the master seed, so results do not depend on which worker runs it
+        hits, misses = self.lineup_state_hits, self.lineup_state_misses
+        expected = None
+        shots = EventBuffer(self.SHOT_DTYPE)
+        cards = EventBuffer(self.CARD_DTYPE)
+        if engine in ("vectorized", "vectorized_goals"):
+            shot_cols, card_cols, expected = self._simulate_batch(n_sims, seed, goals_only=(engine == "vectorized_goals"))
+            for cols in shot_cols:
+                shots.extend(*cols)
+            for cols in card_cols:
+                cards.extend(*cols)
+        else:
+            self.stream = RandomStream(seed)
+            for i in range(n_sims):
+                self._simulate_single(i, shots, cards, event_driven=(engine == "events"))
+        shots, cards = self._event_records(start, shots, cards)
+        return shots, cards, (self.lineup_state_hits - hits, self.lineup_state_misses - misses), expected
+
+    def _simulate_batch(self, n_sims, seed=None, goals_only=False):
+        # Shots (or goals) are a Poisson process in its own clock: the k-th one happens in the minute where the
+        # summed rate passes the sum of k unit exponentials. Those come from their own stream in a fixed order per
+        # sim and team, so two scenarios run with the same seed share them (common random numbers), and with
+        # antithetic sims the second half of the chunk uses 1 - u of the first half
+        seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        rng         = np.random.default_rng(np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (0,)))
+        arrival_rng = np.random.default_rng(np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (1,)))
+        arrival_u   = self._arrival_uniforms(arrival_rng, n_sims)
+        arrival_idx = np.ones((n_sims, 4), dtype=int)
+        next_arrival = -np.log1p(-arrival_u[:, :, 0])
+        clock = np.zeros((n_sims, 4))
+
+        def arrivals(stream, rate):
+            # Streams 0/1 are home/away shots (goals without player props), 2/3 home/away missed shots
+            nonlocal arrival_u
+            clock[:, stream] += rate
+            counts = np.zeros(n_sims, dtype=int)
+            due = np.flatnonzero(next_arrival[:, stream] <= clock[:, stream])
+            while due.size:
+                counts[due] += 1
+                if arrival_idx[due, stream].max() >= arrival_u.shape[2]:
+                    arrival_u = np.concatenate([arrival_u, self._arrival_uniforms(arrival_rng, n_sims)], axis=2)
+                next_arrival[due, stream] -= np.log1p(-arrival_u[due, stream, arrival_idx[due, stream]])
+                arrival_idx[due, stream] += 1
+                due = due[next_arrival[due, stream] <= clock[due, stream]]
+            return counts
+
+        # Without player props, shooters and assisters are only drawn for goals, from P(shooter, assister | body part, goal)
+        detailed = self.player_props and not goals_only
+
+        tables    = (self.home_table, self.away_table)
+        sub_mins  = (self.home_sub_minutes, self.away_sub_minutes)
+        ctx_mults = (self.ctx_mult_home, self.ctx_mult_away)
+
+        # [status index, segment - 1] with status index 0..4 ⇒ -1.5, -1, 0, 1, 1.5
+        mult = [np.array([[ctx[(st, sg, 0)] for sg in range(1, 7)] for st in self.STATUS_VALUES]) for ctx in ctx_mults]
+        status_factor = np.array([self.status_factor[-1], self.status_factor[-1], self.status_factor[0], self.status_factor[1], self.status_factor[1]])
+        # Leading, Level, Trailing column of the in/out status probabilities
+        status_col = np.array([2, 2, 1, 0, 0])
+
+        active  = [np.tile(table.starter, (n_sims, 1)) for table in tables]
+        passive = [np.tile(table.bench,   (n_sims, 1)) for table in tables]
+        yellow  = [np.tile(table.sim_yellow, (n_sims, 1)) for table in tables]
+
+        goals = np.zeros((n_sims, 2), dtype=int)
+        goals[:, 0] = self.home_initial_goals
+        goals[:, 1] = self.away_initial_goals
+
+        segment    = np.full(n_sims, self.get_time_segment(self.match_initial_time))
+        changed    = np.ones(n_sims, dtype=bool)
+        team_ra    = [np.zeros((n_sims, 5)), np.zeros((n_sims, 5))]
+        shot_rate  = np.zeros((n_sims, 2))
+        foul_rate  = np.zeros((n_sims, 2))
+        psxg_state = np.zeros((n_sims, 2), dtype=int)
+        goal_xg    = np.zeros((n_sims, 2))
+        expected   = np.zeros((n_sims, 2))
+        scorer_w   = [np.zeros((n_sims, 2, table.n)) for table in tables]
+        psxg_index = [{}, {}]
+        # psxg tables of the chunk's (shot quality totals, score state) keys, in a store that doubles when full
+        psxg_store = [np.zeros((64, len(table.shooter_profiles), len(table.assister_profiles), 2)) for table in tables]
+
+        shot_cols = []
+        card_cols = []
+
+        for minute in range(self.match_initial_time, 91):
+            diff = np.clip(goals[:, 0] - goals[:, 1], -2, 2)
+            status_idx = np.stack([diff + 2, 2 - diff], axis=1)
+
+            if minute in [16, 31, 46, 61, 76]:
+                changed[:] = True
+
+            if minute in self.all_sub_minutes:
+                changed[:] = True
+                for t in (0, 1):
+                    if minute in sub_mins[t]:
+                        self._batch_swap(tables[t], active[t], passive[t], sub_mins[t][minute], status_col[status_idx[:, t]], rng)
+
+            if changed.any():
+                rows = np.flatnonzero(changed)
+                changed[:] = False
+                segment[rows] = self.get_time_segment(minute)
+
+                for t, o in ((0, 1), (1, 0)):
+                    act_t, act_o = active[t][rows], active[o][rows]
+                    st = status_idx[rows, t]
+
+                    team_ra[t][rows] = act_t @ tables[t].off_coefs - act_o @ tables[o].def_coefs
+                    shot_rate[rows, t] = np.maximum(0, team_ra[t][rows, 0]) * mult[t][st, segment[rows] - 1]
+
+                    team_f90 = (act_t @ tables[t].fouls_committed_90 + act_o @ tables[o].fouls_drawn_90) / 2.0
+                    opp_f90  = (act_o @ tables[o].fouls_committed_90 + act_t @ tables[t].fouls_drawn_90) / 2.0
+                    normaliser = (team_f90 + opp_f90 + self.ref_fouls_pm) / 2.0
+                    per_min = (team_f90 / 90.0) * (team_f90 / np.maximum(1e-5, normaliser)) * self.team_factor[t == 0] * status_factor[st]
+                    foul_rate[rows, t] = np.maximum(per_min, 1e-6)
+
+                    # psxg only depends on the team's shot quality totals and the score state
+                    plsqa = np.column_stack([np.round(team_ra[t][rows, 3], 4), np.round(team_ra[t][rows, 4], 4), np.sign(self.STATUS_VALUES_ARR[st])])
+                    uniq, inverse = np.unique(plsqa, axis=0, return_inverse=True)
+                    table_ids = np.empty(len(uniq), dtype=int)
+                    new = []
+                    for u, key in enumerate(map(tuple, uniq)):
+                        if key not in psxg_index[t]:
+                            psxg_index[t][key] = len(psxg_index[t])
+                            new.append(key)
+                        table_ids[u] = psxg_index[t][key]
+                    if new:
+                        new  = np.array(new)
+                        size = len(psxg_index[t])
+                        if size > len(psxg_store[t]):
+                            grown = np.zeros((max(size, 2 * len(psxg_store[t])),) + psxg_store[t].shape[1:])
+                            grown[:size - len(new)] = psxg_store[t][:size - len(new)]
+                            psxg_store[t] = grown
+                        psxg_store[t][size - len(new):size] = self.build_psxg_tables(tables[t], new[:, 0], new[:, 1], new[:, 2], t == 0)
+                    psxg_state[rows, t] = table_ids[inverse.reshape(-1)]
+
+                    # Mean xG per shot is also the goal rate behind the control variate, so it is kept in every mode
+                    scorer_w[t][rows] = self._batch_scorer_weights(tables[t], act_t, psxg_store[t][psxg_state[rows, t]], team_ra[t][rows])
+                    goal_xg[rows, t]  = scorer_w[t][rows].sum(axis=(1, 2))
+
+            # Goals minus this sum of goal rates has mean zero
+            expected += shot_rate * goal_xg
+
+            for t in (0, 1):
+                table = tables[t]
+                if detailed:
+                    sims = np.repeat(np.arange(n_sims), arrivals(t, shot_rate[:, t]))
+                    if sims.size == 0:
+                        continue
+                    act = active[t][sims]
+
+                    rahs = np.maximum(0, team_ra[t][sims, 1])
+                    rafs = np.maximum(0, team_ra[t][sims, 2])
+                    total = rahs + rafs
+                    p_head = np.divide(rahs, total, out=np.full(len(sims), 0.5), where=total > 0)
+                    is_foot = (rng.random(len(sims)) >= p_head).astype(int)
 
-    def run_simulations(self, n_sims, n_workers):
+                    shooter_w = np.where(is_foot[:, None] == 1, table.footers_rate, table.headers_rate)
+                    shooter = self._batch_pick(shooter_w, act, rng.random(len(sims)))
+
+                    assist_w, assist_allowed = self._batch_assist_options(table, act, shooter, is_foot)
+                    assister = self._batch_pick(assist_w, assist_allowed, rng.random(len(sims)))
+
+                    xg_prob = psxg_store[t][psxg_state[sims, t], table.shooter_profile[shooter], table.assister_profile[assister], is_foot]
+                    outcome = (rng.random(len(sims)) < xg_prob).astype(int)
+                else:
+                    # Goals and missed shots are independent Poisson streams (shot rate × mean xG and × 1 - mean xG).
+                    # A goal takes its body part by its share of the goal mass, a miss by what is left of each body
+                    # part's shot share, and only goals get a scorer (shooter and assister stay -1 otherwise)
+                    goal_sims = np.repeat(np.arange(n_sims), arrivals(t, shot_rate[:, t] * goal_xg[:, t]))
+                    miss_sims = np.empty(0, dtype=int) if goals_only else np.repeat(np.arange(n_sims), arrivals(2 + t, shot_rate[:, t] * (1 - goal_xg[:, t])))
+                    sims = np.concatenate([goal_sims, miss_sims])
+                    if sims.size == 0:
+                        continue
+                    is_goal = np.arange(len(sims)) < len(goal_sims)
+
+                    rahs = np.maximum(0, team_ra[t][sims, 1])
+                    rafs = np.maximum(0, team_ra[t][sims, 2])
+                    total = rahs + rafs
+                    p_head = np.divide(rahs, total, out=np.full(len(sims), 0.5), where=total > 0)
+                    mass = scorer_w[t][sims].sum(axis=2)
+                    head_w = np.where(is_goal, mass[:, 0], np.maximum(0, p_head - mass[:, 0]))
+                    foot_w = np.where(is_goal, mass[:, 1], np.maximum(0, 1 - p_head - mass[:, 1]))
+                    is_foot = (rng.random(len(sims)) * (head_w + foot_w) >= head_w).astype(int)
+                    outcome = is_goal.astype(int)
+
+                    shooter  = np.full(len(sims), -1)
+                    assister = np.full(len(sims), -1)
+                    if len(goal_sims):
+                        scored = np.flatnonzero(is_goal)
+                        shooter[scored], assister[scored] = self._batch_goal_details(table, active[t][goal_sims], scorer_w[t][goal_sims, is_foot[scored]],
+                                                                                     psxg_store[t][psxg_state[goal_sims, t]], is_foot[scored], rng)
+
+                scored = np.bincount(sims, weights=outcome, minlength=n_sims).astype(int)
+                goals[:, t] += scored
+                changed |= scored > 0
+                shot_cols.append((sims, np.full(len(sims), minute), np.full(len(sims), t), shooter, outcome, is_foot, assister))
+
+            for t in (0, 1):
+                n_fouls = rng.poisson(foul_rate[:, t])
+                table = tables[t]
+                # Fouls are resolved one round at a time so a sending-off removes the player before the next foul
+                for r in range(int(n_fouls.max(initial=0))):
+                    sims = np.flatnonzero((n_fouls > r) & active[t].any(axis=1))
+                    if sims.size == 0:
+                        break
+                    fouler = self._batch_pick(np.broadcast_to(table.fouls_committed_rate, active[t][sims].shape), active[t][sims], rng.random(len(sims)))
+
+                    u  = rng.random(len(sims))
+                    yc = u < table.yc_prob[fouler]
+                    rc = ~yc & (u < table.yc_prob[fouler] + table.rc_prob[fouler])
+
+                    yellow[t][sims[yc], fouler[yc]] += 1
+                    sent_off = rc | (yc & (yellow[t][sims, fouler] >= 2))
+                    active[t][sims[sent_off], fouler[sent_off]] = False
+                    changed[sims[sent_off]] = True
+
+                    booked = yc | rc
+                    card_cols.append((sims[booked], np.full(booked.sum(), minute), np.full(booked.sum(), t), fouler[booked], rc[booked]))
+
+        return shot_cols, card_cols, expected
+
+    def _arrival_uniforms(self, rng, n_sims, block=32):
+        # [sim, stream, k] uniforms behind the unit exponentials of _simulate_batch, antithetic pairs mirrored.
+        # With sobol or stratified sampling the sims of a chunk are one scrambled Sobol' or Latin hypercube point
+        # set over (k, stream), so the first arrival of every stream gets the best spread dimensions
+        if self.sampling == "random":
+            u = rng.random((n_sims, 4, block))
+        else:
+            if self.sampling == "sobol":
+                points = qmc.Sobol(4 * block, seed=rng).random_base2(max(1, math.ceil(math.log2(n_sims))))[:n_sims]
+            else:
+                points = qmc.LatinHypercube(4 * block, seed=rng).random(n_sims)
+            u = points.reshape(n_sims, block, 4).transpose(0, 2, 1).copy()
+        if self.antithetic:
+            half = n_sims // 2
+            u[half:2 * half] = 1.0 - u[:half]
+        return u
+
+    def _event_records(self, start, shots, cards):
+        # Filled EventBuffers → structured arrays ordered by sim then minute, with chunk-local sims made global
+        def _records(buffer):
+            records = buffer.array()
+            records = records[np.lexsort((records['minute'], records['sim']))]
+            records['sim'] += start
+            return records
+
+        return _records(shots), _records(cards)
+
+    def run_simulations(self, n_sims, n_workers, engine="loop", seed=None, service=None, tolerance=None, on_progress=None):
+        # With a tolerance, n_sims is only the cap: chunks stop once the key market probabilities are precise enough.
+        # on_progress gets the running final-score table after every chunk
+        results = []
+        lookups = np.zeros(2, dtype=np.int64)
+        # Per-sim goals, goal compensators and antithetic pair ids, for the control-variate estimates
+        sim_goals, sim_expected, sim_groups = [], [], []
+        update = None
+        for update in self.iter_simulations(n_sims, n_workers, engine, seed, service, tolerance):
+            results.append((update['shots'], update['cards']))
+            lookups += update['lookups']
+            if update['expected'] is not None:
+                sim_goals.append(update['sim_goals'])
+                sim_expected.append(update['expected'])
+                sim_groups.append(update['sim_groups'])
+            if on_progress is not None:
+                on_progress({'n_sims': update['total_sims'], 'max_sims': n_sims, 'score_counts': update['score_counts'], 'standard_error': update['standard_error']})
+
+        score_counts = update['score_counts'] if update is not None else np.zeros((self.MAX_GOALS + 1, self.MAX_GOALS + 1), dtype=np.int64)
+        self.last_run = {'engine': engine,
+                         'n_sims': int(score_counts.sum()),
+                         'standard_error': update['standard_error'] if update is not None else self.market_standard_error(score_counts),
+                         'lineup_state_hit_rate': float(lookups[0] / max(1, lookups.sum())),
+                         'score_counts': score_counts}
+        if sim_goals and len(sim_goals) == len(results):
+            self.last_run['sim_goals']    = np.concatenate(sim_goals)
+            self.last_run['sim_expected'] = np.concatenate(sim_expected)
+            self.last_run['estimates']    = self.control_variate_estimates(self.last_run['sim_goals'], self.last_run['sim_expected'], np.concatenate(sim_groups), score_counts)
+            self.last_run['ess']     = min(m['ess'] for m in self.last_run['estimates'].values())
+            self.last_run['raw_ess'] = min(m['raw_ess'] for m in self.last_run['estimates'].values())
+
+        shots = np.concatenate([s for s, _ in results] or [np.empty(0, dtype=self.SHOT_DTYPE)])
+        cards = np.concatenate([c for _, c in results] or [np.empty(0, dtype=self.CARD_DTYPE)])
+        self.last_run['n_shots'] = len(shots['sim'])
+        self.last_run['n_cards'] = len(cards['sim'])
+        return shots, cards
+
+    def iter_simulations(self, n_sims, n_workers, engine="loop", seed=None, service=None, tolerance=None):
+        # The run behind run_simulations, yielded chunk by chunk in sim order: each item carries that chunk's events
+        # plus the running score table and standard error, so a partial run can be priced while the rest simulates.
+        # Closing the generator early stops the run (and its worker pool)
         if n_workers is None:
             n_workers = os.cpu_count() or 1
+        if engine not in self.CHUNK_SIZE:
+            raise ValueError(f"Unknown simulation engine: {engine}")
+        if self.sampling not in self.SAMPLINGS:
+            raise ValueError(f"Unknown sampling: {self.sampling}")
+        if self.sampling != "random" and engine not in ("vectorized", "vectorized_goals"):
+            raise ValueError(f"Sampling {self.sampling} only applies to the vectorized engines")
+        if self.antithetic and engine not in ("vectorized", "vectorized_goals"):
+            raise ValueError("Antithetic sims only apply to the vectorized engines")
+
+        # Chunk boundaries and their child seeds depend only on n_sims and seed, never on n_workers
+        chunk_size = self.chunk_size(engine)
+        starts = range(0, n_sims, chunk_size)
+        chunks = [(engine, start, min(chunk_size, n_sims - start), child) for start, child in zip(starts, np.random.SeedSequence(seed).spawn(len(starts)))]
+
+        score_counts = np.zeros((self.MAX_GOALS + 1, self.MAX_GOALS + 1), dtype=np.int64)
+        sim_goals, sim_expected, sim_groups = [], [], []
+        n_chunks = 0
+        with self._chunk_runner(n_workers, service, len(chunks)) as (run, round_size):
+            if tolerance is None:
+                round_size = len(chunks)
+            progress = tqdm(total=n_sims, desc=f'Simulations ({engine})')
+            try:
+                for r in range(0, len(chunks), round_size):
+                    for chunk, (shots, cards, chunk_lookups, expected) in zip(chunks[r:r + round_size], run(chunks[r:r + round_size])):
+                        n_chunks += 1
+                        score_counts += self.chunk_score_counts(shots, chunk[1], chunk[2])
+                        update = {'start': chunk[1], 'n_sims': chunk[2], 'shots': shots, 'cards': cards, 'lookups': np.array(chunk_lookups), 'expected': expected}
+                        if expected is not None:
+                            update['sim_goals']  = self.chunk_sim_goals(shots, chunk[1], chunk[2])
+                            update['sim_groups'] = self.chunk_sim_groups(chunk[1], chunk[2])
+                            sim_goals.append(update['sim_goals'])
+                            sim_expected.append(expected)
+                            sim_groups.append(update['sim_groups'])
+                        progress.update(chunk[2])
+
+                        # Checked chunk by chunk in order, so where a run stops never depends on the worker count
+                        if len(sim_goals) == n_chunks:
+                            estimates = self.control_variate_estimates(np.concatenate(sim_goals), np.concatenate(sim_expected), np.concatenate(sim_groups), score_counts)
+                            standard_error = max(m['raw_standard_error'] for m in estimates.values())
+                        else:
+                            standard_error = self.market_standard_error(score_counts)
+                        update.update({'score_counts': score_counts.copy(), 'total_sims': int(score_counts.sum()), 'standard_error': standard_error})
+                        yield update
+
+                        if tolerance is not None and score_counts.sum() >= self.MIN_SIMS and standard_error <= tolerance:
+                            return
+            finally:
+                progress.close()
+
+    def chunk_size(self, engine):
+        # Sims per chunk; with sobol sampling a chunk is one whole Sobol' point set
+        return self.SOBOL_CHUNK_SIZE if self.sampling == "sobol" else self.CHUNK_SIZE[engine]
+
+    def compare_engines(self, n_sims, engines=("loop", "events"), seed=None):
+        # Same match through several engines: headline markets per engine plus a chi-square test of
+        # homogeneity on the final-score tables (a small p-value means the engines disagree)
+        summary = {}
+        tables  = []
+        for engine in engines:
+            self.run_simulations(n_sims, 1, engine, seed)
+            counts = self.last_run['score_counts']
+            probs  = counts / counts.sum()
+            h, a = np.indices(probs.shape)
+            summary[engine] = {'home_win': float(probs[h > a].sum()),
+                               'draw': float(probs[h == a].sum()),
+                               'away_win': float(probs[h < a].sum()),
+                               'over_2_5': float(probs[h + a > 2.5].sum()),
+                               'home_goals': float((probs * h).sum()),
+                               'away_goals': float((probs * a).sum()),
+                               'shots_per_sim': self.last_run['n_shots'] / n_sims,
+                               'cards_per_sim': self.last_run['n_cards'] / n_sims}
+            tables.append(counts.ravel())
+
+        observed = np.array(tables)
+        observed = observed[:, observed.sum(axis=0) > 0]
+        summary['score_table_p_value'] = float(chi2_contingency(observed)[1])
+        return summary
+
+    def sampling_benchmark(self, sim_counts=(1000, 2000, 5000, 10000), samplings=SAMPLINGS, repeats=8, engine="vectorized", seed=0):
+        # Error vs sim count per sampling backend: each (sampling, sim count) is run `repeats` times with different
+        # seeds and the error is the root mean square distance of those prices to the exact engine's. The exact
+        # engine leaves red cards out, so its gap to the mean price (bias) is reported apart from the error
+        exact = self._score_markets(self.exact_score_distribution()['final'])
+        sampling = self.sampling
+        summary = {'exact': exact}
+        try:
+            for name in samplings:
+                self.sampling = name
+                summary[name] = {}
+                for n_sims in sim_counts:
+                    runs = []
+                    for r in range(repeats):
+                        self.run_simulations(n_sims, 1, engine, [seed, r])
+                        counts = self.last_run['score_counts']
+                        runs.append(self._score_markets(counts / counts.sum()))
+                    summary[name][n_sims] = {m: {'mean': float(np.mean([run[m] for run in runs])),
+                                                 'error': float(np.sqrt(np.mean([(run[m] - exact[m]) ** 2 for run in runs]))),
+                                                 'spread': float(np.std([run[m] for run in runs], ddof=1)) if repeats > 1 else 0.0,
+                                                 'bias': float(np.mean([run[m] for run in runs]) - exact[m])}
+                                             for m in exact}
+        finally:
+            self.sampling = sampling
+        return summary
+
+    def _score_markets(self, probs):
+        # 1X2, totals and correct-score cells (with the odds tab's 4+ buckets) from a final-score probability table
+        h, a = np.indices(probs.shape)
+        markets = {'home_win': probs[h > a].sum(), 'draw': probs[h == a].sum(), 'away_win': probs[h < a].sum()}
+        for line in (1.5, 2.5, 3.5):
+            markets[f'over_{line}'.replace('.', '_')] = probs[h + a > line].sum()
+        for score in ('0-0', '1-0', '0-1', '1-1', '2-1', '3-2'):
+            markets[score] = probs[int(score[0]), int(score[2])]
+        markets['any_other_home_win'] = probs[4:, :4].sum()
+        markets['any_other_away_win'] = probs[:4, 4:].sum()
+        markets['any_other_draw']     = np.diagonal(probs)[4:].sum()
+        return {m: float(p) for m, p in markets.items()}
 
-        shot_rows = []
-        card_rows = []
-
-        if n_workers > 1:
-            with multiprocessing.Pool(processes=n_workers) as pool:
-                for s, c in tqdm(pool.imap_unordered(self._simulate_single, range(n_sims)),
-                                 total=n_sims,
-                                 desc=f'Simulations ({n_workers} workers)'):
-                    shot_rows.extend(s)
-                    card_rows.extend(c)
-        else: 
-            for i in tqdm(range(n_sims), desc='Simulations (1 worker)'):
-                s, c = self._simulate_single(i)
-                shot_rows.extend(s)
-                card_rows.extend(c)
+    @contextmanager
+    def _chunk_runner(self, n_workers, service, n_chunks):
+        # Yields (run, round_size): run maps chunks to their results in order, round_size is how many to submit at once
+        if service is not None or (n_workers > 1 and n_chunks > 1):
+            self.warm_lineup_states()
+
+        if service is not None:
+            with service.session(self.get_worker_setup()) as run:
+                yield run, service.n_workers
+        elif n_workers > 1 and n_chunks > 1:
+            # The match setup goes to each worker once; tasks only carry chunk bounds and seeds
+            with multiprocessing.Pool(processes=min(n_workers, n_chunks), initializer=_init_sim_worker, initargs=(self.get_worker_setup(),)) as pool:
+                yield (lambda chunks: pool.imap(_run_sim_chunk, chunks)), n_workers
+        else:
+            yield (lambda chunks: (self.simulate_chunk(*chunk) for chunk in chunks)), 1
+
+    def chunk_score_counts(self, shots, start, n_sims):
+        goals = shots['outcome'] == 1
+        sims  = shots['sim'][goals] - start
+        teams = shots['team'][goals]
+        home = self.home_initial_goals + np.bincount(sims[teams == 0], minlength=n_sims)
+        away = self.away_initial_goals + np.bincount(sims[teams == 1], minlength=n_sims)
+
+        counts = np.zeros((self.MAX_GOALS + 1, self.MAX_GOALS + 1), dtype=np.int64)
+        np.add.at(counts, (np.minimum(home, self.MAX_GOALS), np.minimum(away, self.MAX_GOALS)), 1)
+        return counts
+
+    def chunk_sim_goals(self, shots, start, n_sims):
+        goals = shots['outcome'] == 1
+        return np.stack([np.bincount(shots['sim'][goals & (shots['team'] == t)] - start, minlength=n_sims) for t in (0, 1)], axis=1)
+
+    def chunk_sim_groups(self, start, n_sims):
+        # Antithetic sims share the id of their pair (i and i + half within a chunk), all others are on their own
+        ids  = np.arange(n_sims)
+        half = n_sims // 2
+        if self.antithetic:
+            ids[half:2 * half] -= half
+        return start + ids
+
+    def market_cells(self, score_counts):
+        # The markets behind the stopping rule: 1X2, over 2.5 and the most likely correct scores
+        probs = score_counts / max(1, score_counts.sum())
+        top   = np.argsort(probs, axis=None, kind='stable')[::-1][:self.TOP_SCORES]
+        return ['home_win', 'draw', 'away_win', 'over_2_5'] + [f"{h}-{a}" for h, a in zip(*np.unravel_index(top, probs.shape))]
+
+    def market_values(self, goals, markets):
+        # Per-sim 0/1 outcome of each market, from the simulated goals plus the initial score
+        home = np.minimum(self.home_initial_goals + goals[:, 0], self.MAX_GOALS)
+        away = np.minimum(self.away_initial_goals + goals[:, 1], self.MAX_GOALS)
+        columns = {'home_win': home > away, 'draw': home == away, 'away_win': home < away, 'over_2_5': home + away > 2.5}
+        return np.column_stack([columns[m] if m in columns else (home == int(m.split('-')[0])) & (away == int(m.split('-')[1])) for m in markets]).astype(float)
+
+    def control_variate_estimates(self, goals, expected, groups, score_counts, markets=None):
+        # Goals minus the summed goal rate is a zero-mean control per team; regressing each market on it removes the
+        # part of the noise that comes from how many goals a sim happened to get. Standard errors are taken over
+        # antithetic pairs, and ESS is the plain Monte Carlo sample size with the same standard error. The raw_*
+        # figures are for the plain frequencies, which is what the stored trajectories give
+        markets  = self.market_cells(score_counts) if markets is None else markets
+        adjusted, raw = self.control_variate_values(goals, expected, markets)
+        n = len(goals)
+
+        probability = adjusted.mean(axis=0)
+        standard_error = self.grouped_standard_error(adjusted, groups)
+
+        raw_probability = raw.mean(axis=0)
+        raw_standard_error = self.grouped_standard_error(raw, groups)
+        plain_error = np.sqrt(raw_probability * (1 - raw_probability) / n)
+        ess     = np.where(standard_error > 0, n * plain_error ** 2 / np.maximum(standard_error, 1e-12) ** 2, n)
+        raw_ess = np.where(raw_standard_error > 0, n * plain_error ** 2 / np.maximum(raw_standard_error, 1e-12) ** 2, n)
+        return {m: {'probability': float(probability[j]), 'standard_error': float(standard_error[j]), 'ess': float(ess[j]),
+                    'raw_probability': float(raw_probability[j]), 'raw_standard_error': float(raw_standard_error[j]), 'raw_ess': float(raw_ess[j])}
+                for j, m in enumerate(markets)}
+
+    def grouped_standard_error(self, values, groups):
+        # Standard error of the column means when rows in the same group (antithetic pairs) are not independent
+        group_sums = np.zeros((groups.max() + 1, values.shape[1]))
+        np.add.at(group_sums, groups, values - values.mean(axis=0))
+        n_groups = len(np.unique(groups))
+        return np.sqrt((group_sums ** 2).sum(axis=0) * n_groups / max(1, n_groups - 1)) / len(values)
+
+    def compare_scenarios(self, variant, n_sims, seed=0, engine="vectorized"):
+        # Price change from this match setup to a variant (another lineup, referee, ...). Both run with the same seed,
+        # so sim i of each shares its shot arrivals (common random numbers) and the difference is taken per sim
+        for alg in (self, variant):
+            alg.run_simulations(n_sims, 1, engine, seed)
+            if 'sim_goals' not in alg.last_run:
+                raise ValueError(f"Engine {engine} does not report per-sim goal rates")
+
+        markets = self.market_cells(self.last_run['score_counts'])
+        chunk_size = self.chunk_size(engine)
+        groups  = np.concatenate([self.chunk_sim_groups(start, min(chunk_size, n_sims - start)) for start in range(0, n_sims, chunk_size)])
+        base, base_raw = self.control_variate_values(self.last_run['sim_goals'], self.last_run['sim_expected'], markets)
+        alt, alt_raw   = variant.control_variate_values(variant.last_run['sim_goals'], variant.last_run['sim_expected'], markets)
+
+        paired_error = self.grouped_standard_error(alt - base, groups)
+        independent_error = np.sqrt((base_raw.var(axis=0) + alt_raw.var(axis=0)) / n_sims)
+        ess = np.where(paired_error > 0, n_sims * independent_error ** 2 / np.maximum(paired_error, 1e-12) ** 2, n_sims)
+        return {m: {'base': float(base[:, j].mean()), 'variant': float(alt[:, j].mean()), 'difference': float((alt - base)[:, j].mean()),
+                    'standard_error': float(paired_error[j]), 'independent_error': float(independent_error[j]), 'ess': float(ess[j])}
+                for j, m in enumerate(markets)}
+
+    def control_variate_values(self, goals, expected, markets):
+        # (per-sim market values corrected by the fitted control, raw per-sim market values)
+        raw = self.market_values(goals, markets)
+        control = goals - expected
+        beta = np.linalg.lstsq(control - control.mean(axis=0), raw - raw.mean(axis=0), rcond=None)[0]
+        return raw - control @ beta, raw
+
+    def market_standard_error(self, score_counts):
+        # Largest binomial standard error over 1X2, over 2.5 and the most likely correct scores
+        n = score_counts.sum()
+        if n == 0:
+            return float('inf')
+        probs = score_counts / n
+        h, a = np.indices(probs.shape)
+        markets = [probs[h > a].sum(), probs[h == a].sum(), probs[h < a].sum(), probs[h + a > 2.5].sum()]
+        markets.extend(np.sort(probs, axis=None)[-self.TOP_SCORES:])
+        markets = np.array(markets)
+        return float(np.sqrt(markets * (1 - markets) / n).max())
+
+    def get_worker_setup(self):
+        # Immutable match setup for pool workers: tables, multipliers, boosters and the warm prediction and lineup state caches.
+        # Lineup samplers are cheap to rebuild and the stream is replaced per chunk
+        return {k: v for k, v in self.__dict__.items() if k not in self.WORKER_LOCAL_STATE}
+
+    @classmethod
+    def from_worker_setup(cls, setup):
+        alg = cls.__new__(cls)
+        alg.__dict__.update(setup)
+        # A setup taken in-process (in_play_trajectories on a worker thread) would otherwise share the source's caches
+        for name in cls.WORKER_CACHES:
+            setattr(alg, name, dict(setup[name]))
+        alg.player_probs_cache   = {}
+        alg.fouler_sampler_cache = {}
+        alg.on_progress = None
+        alg.stream = RandomStream()
+        return alg
+
+    def exact_score_distribution(self):
+        # Score tensor propagated minute by minute with no sampling: within a minute each side's goals are
+        # Poisson(shot rate × mean xG per shot), the same thinning the simulations do shot by shot.
+        # Substitutions enter as on-pitch probabilities (expected schedule) and red cards are left out
+        G = self.MAX_GOALS + 1
+        tables   = (self.home_table, self.away_table)
+        sub_mins = (self.home_sub_minutes, self.away_sub_minutes)
+
+        scores = np.zeros((G, G))
+        scores[min(self.home_initial_goals, G - 1), min(self.away_initial_goals, G - 1)] = 1.0
+        on_pitch = [table.starter.astype(float) for table in tables]
+
+        h, a = np.indices((G, G))
+        diff_class = np.clip(h - a, -2, 2) + 2   # index into STATUS_VALUES from the home side
+
+        by_minute = [scores]
+        segment = self.get_time_segment(self.match_initial_time)
+        rates = None
+        for minute in range(self.match_initial_time, 91):
+            if minute in [16, 31, 46, 61, 76]:
+                segment = self.get_time_segment(minute)
+                rates = None
 
-        return shot_rows, card_rows
+            if minute in self.all_sub_minutes:
+                segment = self.get_time_segment(minute)
+                rates = None
+                # Leading, Level, Trailing probabilities at the moment of the substitution
+                home_status = np.array([scores[h > a].sum(), scores[h == a].sum(), scores[h < a].sum()])
+                for t, status_probs in ((0, home_status), (1, home_status[::-1])):
+                    if minute in sub_mins[t]:
+                        on_pitch[t] = self._expected_swap(tables[t], on_pitch[t], sub_mins[t][minute], status_probs)
+
+            if rates is None:
+                rates = self._exact_goal_rates(on_pitch, segment)
+
+            new_scores = np.zeros((G, G))
+            for cls in range(len(self.STATUS_VALUES)):
+                state = np.where(diff_class == cls, scores, 0.0)
+                if state.any():
+                    new_scores += self._goal_transition(rates[cls, 0]).T @ state @ self._goal_transition(rates[cls, 1])
+            scores = new_scores
+            by_minute.append(scores)
+
+        # by_minute[k] is the score distribution at the start of minute match_initial_time + k; the last one is full time
+        return {'minutes': np.arange(self.match_initial_time, 92), 'by_minute': np.array(by_minute), 'final': scores}
+
+    def _exact_goal_rates(self, on_pitch, segment):
+        # [status class, team] goals per minute, status class 0..4 ⇒ home diff ≤ -2 .. ≥ 2
+        tables    = (self.home_table, self.away_table)
+        ctx_mults = (self.ctx_mult_home, self.ctx_mult_away)
+        rates = np.zeros((len(self.STATUS_VALUES), 2))
+        for t, o in ((0, 1), (1, 0)):
+            team_ra = on_pitch[t] @ tables[t].off_coefs - on_pitch[o] @ tables[o].def_coefs
+            shot_xg = {}
+            for cls in range(len(self.STATUS_VALUES)):
+                status = self.STATUS_VALUES[cls] if t == 0 else self.STATUS_VALUES[-1 - cls]
+                if np.sign(status) not in shot_xg:
+                    shot_xg[np.sign(status)] = self._expected_shot_xg(tables[t], on_pitch[t], team_ra, status, t == 0)
+                rates[cls, t] = max(0, team_ra[0]) * ctx_mults[t][(status, segment, 0)] * shot_xg[np.sign(status)]
+        return rates
+
+    def _expected_shot_xg(self, table, on_pitch, team_ra, status, is_home):
+        psxg = self.build_psxg_tables(table, [team_ra[3]], [team_ra[4]], [status], is_home)[0]
+        return self.shot_goal_weights(table, on_pitch, psxg, max(0, team_ra[1]), max(0, team_ra[2])).sum()
+
+    def shot_goal_weights(self, table, on_pitch, psxg, rahs, rafs):
+        # [body part, shooter, assister or None (index n)] ⇒ P(shot) × its post-shot xG, with the shot picked as
+        # get_shot_type/get_shooter/get_assister do. The sum is the mean xG per shot; normalised it is who scored and how
+        n = table.n
+        xg = psxg[table.shooter_profile[:, None], table.assister_profile[None, :], :]
+        p_head = 0.5 if rahs + rafs == 0 else rahs / (rahs + rafs)
+
+        # Assister weights: teammates on the pitch by key passes, plus the unassisted slot for footers
+        teammates = np.append(on_pitch, 0.0)[None, :] * (1.0 - np.eye(n, n + 1))
+        key_passes = teammates * np.append(table.key_passes_rate, 0.0)
+
+        weights = np.zeros((2, n, n + 1))
+        for body, p_body, shooter_rate, unassisted in ((0, p_head, table.headers_rate, 0.0),
+                                                       (1, 1 - p_head, table.footers_rate, table.non_assisted_footers_rate)):
+            shooter = on_pitch * shooter_rate
+            shooter = shooter / shooter.sum() if shooter.sum() > 0 else on_pitch / on_pitch.sum()
+
+            assist_weights = key_passes.copy()
+            assist_weights[:, n] = unassisted
+            allowed = teammates.copy()
+            allowed[:, n] = body
+            total = assist_weights.sum(axis=1, keepdims=True)
+            fallback = allowed / np.maximum(1e-12, allowed.sum(axis=1, keepdims=True))
+            assister = np.where(total > 0, assist_weights / np.where(total > 0, total, 1), fallback)
+
+            weights[body] = p_body * shooter[:, None] * assister * xg[:, :, body]
+        return weights
+
+    def _expected_swap(self, table, on_pitch, subs, status_probs):
+        # Pick probabilities of swap_players for the most likely lineup, mixed over the score state. They are exact up
+        # to EXACT_SWAP_ORDERINGS pick orders (11 starters, 4 subs ⇒ 7920 orders, 5 subs ⇒ 55440); the count is factorial in the subs, so
+        # past that they are estimated from a fixed-seed sample of the same draw without replacement
+        def _inclusion(probs, k):
+            candidates = np.flatnonzero(probs > 0)
+            k = min(k, len(candidates))
+            inclusion = np.zeros(len(probs))
+            if math.perm(len(candidates), k) > self.EXACT_SWAP_ORDERINGS:
+                rng  = np.random.default_rng(0)
+                keys = np.log(rng.random((self.SWAP_SAMPLES, len(candidates)))) / probs[candidates]
+                picked = np.argsort(-keys, axis=1)[:, :k]
+                inclusion[candidates] = np.bincount(picked.ravel(), minlength=len(candidates)) / self.SWAP_SAMPLES
+                return inclusion
+            for order in itertools.permutations(candidates.tolist(), k):
+                p, taken = 1.0, 0.0
+                for i in order:
+                    p *= probs[i] / max(1e-12, 1 - taken)
+                    taken += probs[i]
+                inclusion[list(order)] += p
+            return inclusion
+
+        lineup = np.flatnonzero(on_pitch >= 0.5)
+        bench  = np.flatnonzero(table.bench & (on_pitch < 0.5))
+        if subs <= 0 or len(lineup) == 0 or len(bench) == 0:
+            return on_pitch
+
+        out_prob = np.zeros(len(lineup))
+        in_prob  = np.zeros(len(bench))
+        for status_col, p_status in enumerate(status_probs):
+            if p_status == 0:
+                continue
+            lineup_minutes = table.minutes_played[lineup]
+            out_weights = (1 - (lineup_minutes / lineup_minutes.sum())) * table.out_status_prob[lineup, status_col]
+            out_prob += p_status * _inclusion(self.swap_probabilities(out_weights, subs), subs)
+
+            bench_minutes = table.minutes_played[bench]
+            in_weights = (bench_minutes / bench_minutes.sum()) * table.in_status_prob[bench, status_col]
+            in_prob += p_status * _inclusion(self.swap_probabilities(in_weights, subs), subs)
+
+        on_pitch = on_pitch.copy()
+        on_pitch[lineup] *= 1 - out_prob
+        on_pitch[bench]  += (1 - on_pitch[bench]) * in_prob
+        return on_pitch
+
+    def _goal_transition(self, rate):
+        # [goals before, goals after] for one minute of Poisson(rate) goals, the overflow kept in the last cell
+        G = self.MAX_GOALS + 1
+        pmf = np.empty(G)
+        pmf[0] = math.exp(-rate)
+        for k in range(1, G):
+            pmf[k] = pmf[k - 1] * rate / k
+        transition = np.zeros((G, G))
+        for i in range(G):
+            transition[i, i:] = pmf[:G - i]
+            transition[i, -1] += max(0.0, 1 - transition[i].sum())
+        return transition
 
     def train_context_ras_model(self):
         def flip(series: pd.Series) -> pd.Series:
@@ -2536,11 +3885,11 @@ class Alg:
 
         for col in cat_cols:
             pref = f'{col}_'
-            vals = df[col].astype(str)
-            for i, v in enumerate(vals):
+            vals = df[col].astype(str).to_numpy()
+            for v in np.unique(vals):
                 idx = self.rsq_col_idx.get(f'{pref}{v}')
                 if idx is not None:
-                    X[i, idx] = 1.0
+                    X[vals == v, idx] = 1.0
 
         return self.rsq_booster.inplace_predict(X)
 
@@ -2626,124 +3975,99 @@ class Alg:
 
         for col in cat_cols:
             pref = f'{col}_'
-            for i, v in enumerate(df[col].astype(str)):
+            vals = df[col].astype(str).to_numpy()
+            for v in np.unique(vals):
                 idx = self.psg_col_idx.get(f'{pref}{v}')
                 if idx is not None:
-                    X[i, idx] = 1.0
+                    X[vals == v, idx] = 1.0
 
         return self.psxg_booster.inplace_predict(X)
 
-    def build_xg_cache(self,
-                       active_ids      : list[int],
-                       players_df      ,
-                       plsqa_head      : float,
-                       plsqa_foot      : float,
-                       match_state_num : int,
-                       player_dif_num  : int) -> dict:
-
-        def _safe_sq(src, pid):
-            if isinstance(src, pd.DataFrame):
-                for col in ('sq', 'shooter_sq'):
-                    if col in src.columns and pid in src.index:
-                        return float(src.at[pid, col])
-                return 0.0
-            rec = src.get(pid, {})
-            return float(rec.get('sq', 0.0)) if isinstance(rec, dict) else 0.0
-
-        state = 'Trailing' if match_state_num < 0 else 'Leading' if match_state_num > 0 else 'Level'
-        pdif  = 'Neg'      if player_dif_num  < 0 else 'Pos'     if player_dif_num  > 0 else 'Neu'
-
-        assist_pool = [None] + active_ids
-        cache_keys, new_rows, out = [], [], {}
-
-        for shooter in active_ids:
-            shooter_sq = _safe_sq(players_df, shooter)
-            for assister in assist_pool:
-                assister_sq = 0.0 if assister is None else _safe_sq(players_df, assister)
-                for body, plsqa in (('Head', plsqa_head), ('Foot', plsqa_foot)):
-                    key = (round(plsqa, 4), shooter_sq, assister_sq, state, pdif)
-                    cache_keys.append((shooter, assister, body, key))
-                    if key not in self.rsq_pred_cache:
-                        new_rows.append(dict(total_plsqa=plsqa,
-                                             shooter_sq=shooter_sq,
-                                             assister_sq=assister_sq,
-                                             match_state=state,
-                                             player_dif=pdif))
-
-        if new_rows:
-            preds = self._predict_refined_sq_bulk(pd.DataFrame(new_rows))
-            for k, p in zip([ck[-1] for ck in cache_keys if ck[-1] not in self.rsq_pred_cache], preds):
-                self.rsq_pred_cache[k] = float(p)
-
-        for shooter, assister, body, k in cache_keys:
-            out[(shooter, assister, body)] = self.rsq_pred_cache[k]
-
-        return out
-
-    def build_psxg_cache(self,
-                         active_ids      : list[int],
-                         players_df      ,
-                         plsqa_head      : float,
-                         plsqa_foot      : float,
-                         match_state_num : int,
-                         player_dif_num  : int,
-                         is_home         : bool,
-                         opp_players_df  ) -> dict:
-
-        rsq_cache = self.build_xg_cache(active_ids, players_df,
-                                        plsqa_head, plsqa_foot,
-                                        match_state_num, player_dif_num)
-
-        def _safe(src, pid, col):
-            if isinstance(src, pd.DataFrame):
-                return float(src.at[pid, col]) if col in src.columns and pid in src.index else 0.0
-            rec = src.get(pid, {})
-            return float(rec.get(col, 0.0)) if isinstance(rec, dict) else 0.0
-
-        if isinstance(opp_players_df, pd.DataFrame):
-            gk_rows = opp_players_df[opp_players_df.get('position') == 'GK']
-            gk_ability = float(gk_rows['GK_A'].iloc[0]) if not gk_rows.empty else 0.0
-        else:
-            gk_ability = 0.0
-
-        team_elev   = self.home_elevation_dif if is_home else self.away_elevation_dif
-        team_travel = 0.0 if is_home else self.away_travel
-        team_rest   = self.home_rest_days if is_home else self.away_rest_days
-        match_time  = 'evening'
-
-        cache_keys, new_rows, out = [], [], {}
-        assist_pool = [None] + active_ids
-
-        for shooter in active_ids:
-            shooter_ability = _safe(players_df, shooter, 'shooter_A')
-            for assister in assist_pool:
-                for body, rsq in (( 'Head', rsq_cache.get((shooter, assister, 'Head'), 0.0)),
-                                  ( 'Foot', rsq_cache.get((shooter, assister, 'Foot'), 0.0))):
-                    key = (round(rsq, 4), shooter_ability, gk_ability, is_home)
-                    cache_keys.append((shooter, assister, body, key))
-                    if key not in self.psxg_pred_cache:
-                        new_rows.append(dict(
-                            RSQ=rsq,
-                            shooter_A=shooter_ability,
-                            GK_A=gk_ability,
-                            team_is_home=int(is_home),
-                            team_elevation_dif=team_elev,
-                            team_travel=team_travel,
-                            team_rest_days=team_rest,
-                            temperature_c=self.temperature,
-                            is_raining=int(self.is_raining),
-                            match_time=match_time
-                        ))
-
-        if new_rows:
-            preds = self._predict_post_shot_bulk(pd.DataFrame(new_rows))
-            for k, p in zip([ck[-1] for ck in cache_keys if ck[-1] not in self.psxg_pred_cache], preds):
-                self.psxg_pred_cache[k] = float(p)
-
-        for shooter, assister, body, k in cache_keys:
-            out[(shooter, assister, body)] = self.psxg_pred_cache[k]
-
-        return out
+    def get_psxg_table(self, table, plhsq, plfsq, status, is_home):
+        # One team's psxg table, through the same per-state cache as build_psxg_tables
+        return self.build_psxg_tables(table, [plhsq], [plfsq], [status], is_home)[0]
+
+    def _cached_predictions(self, cache, keys, predict, limit):
+        # Values of distinct keys from a bounded cache, the missing ones predicted in one call.
+        # Like the other caches it is cleared wholesale when the new entries would not fit
+        values  = {key: cache.get(key) for key in keys}
+        missing = [key for key, value in values.items() if value is None]
+        if missing:
+            preds = list(predict(missing))
+            values.update(zip(missing, preds))
+            if len(cache) + len(missing) > limit:
+                cache.clear()
+            cache.update(zip(missing, preds))
+        return [values[key] for key in keys]
+
+    def build_psxg_tables(self, table, plhsq, plfsq, status, is_home):
+        # Refined SQ then post-shot xG for each (team shot quality totals, score state), evaluated in bulk.
+        # Tables are [state, shooter profile, assister profile, body part] with body part 0 ⇒ Head.
+        # Finished tables are cached per rounded state, so only states never seen go through the models
+        keys = list(zip([is_home] * len(plhsq),
+                        np.round(np.asarray(plhsq, dtype=float), 4).tolist(),
+                        np.round(np.asarray(plfsq, dtype=float), 4).tolist(),
+                        np.sign(np.asarray(status, dtype=float)).tolist()))
+        distinct = list(dict.fromkeys(keys))
+        tables = self._cached_predictions(self.psxg_table_cache, distinct,
+                                          lambda missing: self._predict_psxg_tables(table, np.array(missing)[:, 1:], is_home),
+                                          self.SAMPLER_CACHE_SIZE)
+        tables = dict(zip(distinct, tables))
+        return np.stack([tables[key] for key in keys])
+
+    def _predict_psxg_tables(self, table, states, is_home):
+        # states rows are (rounded plhsq, rounded plfsq, sign of status). Model inputs are built as grids over their
+        # distinct parts, so each refined SQ and post-shot xG input is looked up or predicted once
+        shooter_sq, shooter_ability = np.array(table.shooter_profiles, dtype=float).reshape(-1, 2).T
+        assister_sq = np.array(table.assister_profiles, dtype=float)
+        n_assister  = len(assister_sq)
+
+        def _refined_sq(keys):
+            # Predict from the rounded key itself so a cached value never depends on which sim filled it
+            keys = np.array(keys)
+            return self._predict_refined_sq_bulk(pd.DataFrame({
+                'total_plsqa': keys[:, 0],
+                'shooter_sq':  keys[:, 1],
+                'assister_sq': keys[:, 2],
+                'match_state': np.where(keys[:, 3] < 0, 'Trailing', np.where(keys[:, 3] > 0, 'Leading', 'Level')),
+                'player_dif':  'Neu'})).astype(float).tolist()
+
+        def _post_shot(keys):
+            keys = np.array([key[:2] for key in keys])
+            return self._predict_post_shot_bulk(pd.DataFrame({
+                'RSQ':                keys[:, 0],
+                'shooter_A':          keys[:, 1],
+                'GK_A':               0.0,
+                'team_is_home':       int(is_home),
+                'team_elevation_dif': self.home_elevation_dif if is_home else self.away_elevation_dif,
+                'team_travel':        0.0 if is_home else self.away_travel,
+                'team_rest_days':     self.home_rest_days if is_home else self.away_rest_days,
+                'temperature_c':      self.temperature,
+                'is_raining':         int(self.is_raining),
+                'match_time':         'evening'})).astype(float).tolist()
+
+        # Refined SQ over (team plsqa of the body part, score state) × shooter sq × assister sq
+        plsqa_state = np.column_stack([states[:, :2].ravel(), np.repeat(states[:, 2], 2)])
+        plsqa_state, plsqa_idx = np.unique(plsqa_state, axis=0, return_inverse=True)
+        sq, sq_idx = np.unique(shooter_sq, return_inverse=True)
+        grid = (len(plsqa_state), len(sq), n_assister)
+        rsq_keys = np.stack([np.broadcast_to(plsqa_state[:, None, None, 0], grid),
+                             np.broadcast_to(sq[None, :, None], grid),
+                             np.broadcast_to(assister_sq[None, None, :], grid),
+                             np.broadcast_to(plsqa_state[:, None, None, 1], grid)], axis=-1).reshape(-1, 4)
+        rsq = self._cached_predictions(self.rsq_pred_cache, list(map(tuple, rsq_keys.tolist())), _refined_sq, self.PREDICTION_CACHE_SIZE)
+        rsq = np.round(np.array(rsq), 4).reshape(grid)
+        # → [state, shooter profile, assister profile, body part]
+        rsq = rsq[plsqa_idx.reshape(-1, 2)[:, None, None, :], sq_idx[None, :, None, None], np.arange(n_assister)[None, None, :, None]]
+
+        # Post-shot xG over distinct (refined SQ, shooter ability) pairs
+        rsq_values, rsq_idx = np.unique(rsq, return_inverse=True)
+        abilities, ability_idx = np.unique(shooter_ability, return_inverse=True)
+        codes = rsq_idx.reshape(rsq.shape) * len(abilities) + ability_idx[None, :, None, None]
+        codes, code_idx = np.unique(codes, return_inverse=True)
+        psxg_keys = zip(rsq_values[codes // len(abilities)].tolist(), abilities[codes % len(abilities)].tolist())
+        psxg = self._cached_predictions(self.psxg_pred_cache, [(r, a, is_home) for r, a in psxg_keys], _post_shot, self.PREDICTION_CACHE_SIZE)
+        return np.array(psxg)[code_idx.reshape(rsq.shape)]
 
     def divide_matched_players(self, players_data):
         starters = [p['player_id'] for p in players_data if p['on_field']]
@@ -2846,7 +4170,7 @@ class Alg:
 
         return home_distribution, away_distribution
 
-    def swap_players(self, active_players, passive_players, players_data, subs, game_status_n):
+    def swap_players(self, active_players, passive_players, table, subs, game_status_n):
         def interpret_game_status(status_code):
             if status_code > 0:
                 return "Leading"
@@ -2854,133 +4178,121 @@ class Alg:
                 return "Trailing"
             else:
                 return "Level"
-            
-        game_status = interpret_game_status(game_status_n)
 
-        total_active_minutes = 0
-        for player in active_players:
-            total_active_minutes += players_data[player]['minutes_played']
+        status_col = PlayerTable.STATUS_COLUMNS.index(interpret_game_status(game_status_n))
 
-        active_players_dict = {}
+        active  = np.asarray(active_players.players)
+        passive = np.asarray(passive_players)
 
-        for player in active_players:
-            active_players_dict[player] = (1 - (players_data[player]['minutes_played'] / total_active_minutes)) * (players_data[player]['out_status_prob'][game_status])
+        active_minutes = table.minutes_played[active]
+        active_weights = (1 - (active_minutes / active_minutes.sum())) * table.out_status_prob[active, status_col]
+        picked_out_players = self.stream.generator.choice(active, p=self.swap_probabilities(active_weights, subs), replace=False, size=subs)
 
-        total_active_p = sum(active_players_dict.values())
-        if total_active_p == 0:
-            num_players = len(active_players_dict)
-            normalized_active_p = {key: 1.0 / num_players for key in active_players_dict.keys()}
-        else:
-            normalized_active_p = {key: value / total_active_p for key, value in active_players_dict.items()}
-            probabilities = list(normalized_active_p.values())
-            if subs > 1 and probabilities.count(1.0) == 1:
-                max_index = probabilities.index(1.0)
-                probabilities[max_index] = 0.99
-                small_probability = 0.01 / (len(probabilities) - 1)
-                for i in range(len(probabilities)):
-                    if i != max_index:
-                        probabilities[i] = small_probability
-            for i, key in enumerate(normalized_active_p.keys()):
-                normalized_active_p[key] = probabilities[i]
-
-        active_weights = list(normalized_active_p.values())     
-
-        picked_out_players = np.random.choice(active_players, p=active_weights, replace=False, size=subs)
-
-        total_passive_minutes = 0
-        for player in passive_players:
-            total_passive_minutes += players_data[player]['minutes_played']
-
-        passive_players_dict = {}
-
-        for player in passive_players:
-            passive_players_dict[player] = (players_data[player]['minutes_played'] / total_passive_minutes) * (players_data[player]['in_status_prob'][game_status])
-
-        total_passive_p = sum(passive_players_dict.values())
-        if total_passive_p == 0:
-            num_players = len(passive_players_dict)
-            normalized_passive_p = {key: 1.0 / num_players for key in passive_players_dict.keys()}
-        else:
-            normalized_passive_p = {key: value / total_passive_p for key, value in passive_players_dict.items()}
-            probabilities = list(normalized_passive_p.values())
-            if subs > 1 and probabilities.count(1.0) == 1:
-                max_index = probabilities.index(1.0)
-                probabilities[max_index] = 0.99
-                small_probability = 0.01 / (len(probabilities) - 1)
-                for i in range(len(probabilities)):
-                    if i != max_index:
-                        probabilities[i] = small_probability
-            for i, key in enumerate(normalized_passive_p.keys()):
-                normalized_passive_p[key] = probabilities[i]
-
-        passive_weights = list(normalized_passive_p.values())   
-
-        picked_in_players = np.random.choice(passive_players, p=passive_weights, replace=False, size=subs)
-
-        active_players = [player for player in active_players if player not in picked_out_players]
-        active_players.extend(picked_in_players)
+        passive_minutes = table.minutes_played[passive]
+        passive_weights = (passive_minutes / passive_minutes.sum()) * table.in_status_prob[passive, status_col]
+        picked_in_players = self.stream.generator.choice(passive, p=self.swap_probabilities(passive_weights, subs), replace=False, size=subs)
+
+        active_players.swap(picked_out_players.tolist(), picked_in_players.tolist())
         passive_players = [player for player in passive_players if player not in picked_in_players]
 
         return active_players, passive_players
 
-    def get_teams_ra(self, offensive_players, defensive_players, offensive_data, defensive_data):
-        # team_total_ras
-        team_off_ras = 0
-        for player in offensive_players:
-            team_off_ras += offensive_data[player]['off_sh_coef']
-
-        opp_def_ras = 0
-        for player in defensive_players:
-            opp_def_ras += defensive_data[player]['def_sh_coef']
-
-        team_total_ras = team_off_ras - opp_def_ras
-
-        # team_rahs
-        team_off_rahs = 0
-        for player in offensive_players:
-            team_off_rahs += offensive_data[player]['off_headers_coef']
-
-        opp_def_rahs = 0
-        for player in defensive_players:
-            opp_def_rahs += defensive_data[player]['def_headers_coef']
-
-        team_rahs = team_off_rahs - opp_def_rahs
-
-        # team_rafs
-        team_off_rafs = 0
-        for player in offensive_players:
-            team_off_rafs += offensive_data[player]['off_footers_coef']
-
-        opp_def_rafs = 0
-        for player in defensive_players:
-            opp_def_rafs += defensive_data[player]['def_footers_coef']
-
-        team_rafs = team_off_rafs - opp_def_rafs
-
-        # team_plhsq
-        team_off_plhsq = 0
-        for player in offensive_players:
-            team_off_plhsq += offensive_data[player]['off_hxg_coef']
-
-        opp_def_plhsq = 0
-        for player in defensive_players:
-            opp_def_plhsq += defensive_data[player]['def_hxg_coef']
-
-        team_plhsq = team_off_plhsq - opp_def_plhsq
-
-        # team_plfsq
-        team_off_plfsq = 0
-        for player in offensive_players:
-            team_off_plfsq += offensive_data[player]['off_fxg_coef']
-
-        opp_def_plfsq = 0
-        for player in defensive_players:
-            opp_def_plfsq += defensive_data[player]['def_fxg_coef']
-
-        team_plfsq = team_off_plfsq - opp_def_plfsq
-
+    def swap_probabilities(self, weights, subs):
+        total_p = weights.sum()
+        if total_p == 0:
+            return np.full(len(weights), 1.0 / len(weights))
+        probabilities = weights / total_p
+        if subs > 1 and np.count_nonzero(probabilities == 1.0) == 1:
+            max_index = int(np.argmax(probabilities))
+            probabilities = np.full(len(probabilities), 0.01 / (len(probabilities) - 1))
+            probabilities[max_index] = 0.99
+        return probabilities
+
+    def _batch_swap(self, table, active, passive, subs, status_col, rng):
+        def _pick(weights, allowed):
+            weights = np.where(allowed, np.nan_to_num(weights), 0.0)
+            total = weights.sum(axis=1, keepdims=True)
+            uniform = allowed / np.maximum(1, allowed.sum(axis=1, keepdims=True))
+            probs = np.where(total > 0, weights / np.where(total > 0, total, 1), uniform)
+            # Same fallback as swap_players: keep the favourite but leave room for the rest of the sample
+            short = allowed.any(axis=1) & ((probs > 0).sum(axis=1) < subs)
+            if short.any():
+                n_allowed = np.maximum(2, allowed[short].sum(axis=1, keepdims=True))
+                probs[short] = np.where(probs[short] > 0, probs[short] * 0.99, allowed[short] * 0.01 / (n_allowed - 1))
+
+            # Exponential keys give weighted sampling without replacement in one shot
+            keys = np.full(probs.shape, -np.inf)
+            positive = probs > 0
+            keys[positive] = np.log(rng.random(positive.sum())) / probs[positive]
+            picked = np.argsort(-keys, axis=1)[:, :subs]
+            valid = np.isfinite(np.take_along_axis(keys, picked, axis=1))
+            return picked, valid
+
+        rows = np.arange(active.shape[0])[:, None]
+
+        total_active_minutes = active @ table.minutes_played
+        out_w = (1 - table.minutes_played / np.maximum(1e-9, total_active_minutes)[:, None]) * table.out_status_prob[:, status_col].T
+        picked_out, valid_out = _pick(out_w, active)
+
+        total_passive_minutes = passive @ table.minutes_played
+        in_w = (table.minutes_played / np.maximum(1e-9, total_passive_minutes)[:, None]) * table.in_status_prob[:, status_col].T
+        picked_in, valid_in = _pick(in_w, passive)
+
+        active[np.broadcast_to(rows, picked_out.shape)[valid_out], picked_out[valid_out]] = False
+        active[np.broadcast_to(rows, picked_in.shape)[valid_in], picked_in[valid_in]] = True
+        passive[np.broadcast_to(rows, picked_in.shape)[valid_in], picked_in[valid_in]] = False
+
+    def get_lineup_state(self, home_lineup, away_lineup, home_status, away_status, time_segment):
+        # Everything a minute of simulation needs for a (home lineup, away lineup, status, segment), per team:
+        # (context_ras, rahs, rafs, player samplers, psxg table, foul probability). Lineup sums are exact, so a
+        # cached state never depends on which sim built it
+        key = (home_lineup.key, away_lineup.key, home_status, time_segment)
+        state = self.lineup_state_cache.get(key)
+        if state is not None:
+            self.lineup_state_hits += 1
+            return state
+        self.lineup_state_misses += 1
+        if len(self.lineup_state_cache) >= self.SAMPLER_CACHE_SIZE:
+            self.lineup_state_cache.clear()
+
+        state = []
+        for lineup, opponents, status, ctx_mult, is_home in ((home_lineup, away_lineup, home_status, self.ctx_mult_home, True),
+                                                             (away_lineup, home_lineup, away_status, self.ctx_mult_away, False)):
+            ras, rahs, rafs, plhsq, plfsq = self.get_teams_ra(lineup, opponents)
+            state.append((max(0, ras) * ctx_mult[(status, time_segment, 0)],
+                          rahs,
+                          rafs,
+                          self.build_player_probs(lineup.players, lineup.table),
+                          self.get_psxg_table(lineup.table, plhsq, plfsq, status, is_home),
+                          self.get_team_foul_prob(lineup, opponents, status, is_home)))
+
+        state = tuple(state)
+        self.lineup_state_cache[key] = state
+        return state
+
+    def warm_lineup_states(self):
+        # Starting lineups for every score state and remaining segment, built before the setup is shipped to workers
+        home_players = Lineup(self.home_table, self.home_table.starters.tolist())
+        away_players = Lineup(self.away_table, self.away_table.starters.tolist())
+        for minute in sorted({self.match_initial_time, 16, 31, 46, 61, 76}):
+            if minute < self.match_initial_time:
+                continue
+            for home_status in self.STATUS_VALUES:
+                self.get_lineup_state(home_players, away_players, home_status, -home_status, self.get_time_segment(minute))
+
+    def lineup_state_stats(self):
+        lookups = self.lineup_state_hits + self.lineup_state_misses
+        return {'hits': self.lineup_state_hits,
+                'misses': self.lineup_state_misses,
+                'hit_rate': self.lineup_state_hits / lookups if lookups else 0.0,
+                'size': len(self.lineup_state_cache)}
+
+    def get_teams_ra(self, offensive_lineup, defensive_lineup):
+        # [team_total_ras, team_rahs, team_rafs, team_plhsq, team_plfsq] from the running lineup sums
+        team_ra = offensive_lineup.off_coefs - defensive_lineup.def_coefs
+        team_total_ras, team_rahs, team_rafs, team_plhsq, team_plfsq = team_ra.tolist()
         return team_total_ras, team_rahs, team_rafs, team_plhsq, team_plfsq
- 
+
     def get_status(self, home_goals, away_goals):
         diff = home_goals - away_goals
         if diff == 0:
@@ -3013,107 +4325,203 @@ class Alg:
         rafs = max(0, rafs)
 
         total = rahs + rafs
-        if total == 0:
-            probs = [0.5, 0.5]
-        else:
-            probs = [rahs / total, rafs / total]
-        
-        selected_index = np.random.choice([0, 1], p=probs)
+        p_head = 0.5 if total == 0 else rahs / total
 
-        if selected_index == 0:
+        if self.stream.uniform() < p_head:
             body_part = "Head"
         else:
             body_part = "Foot"
         return body_part
-    
-    def build_player_probs(self, active_players, players_data):
-        def _normalise(rate_dict):
-            tot = sum(rate_dict.values())
-            if tot == 0:
-                n = len(rate_dict)
-                return {k: 1 / n for k in rate_dict}
-            return {k: v / tot for k, v in rate_dict.items()}
-
-        rates = {
-            'headers': {},
-            'footers': {},
-            'non_assisted_footers': {},
-            'key_passes': {}
-        }
-
-        for player in active_players:
-            data    = players_data[player]
-            minutes = max(1, data.get('minutes_played', 1))
-
-            rates['headers'][player]              = data.get('headers', 0) / minutes
-            rates['footers'][player]              = data.get('footers', 0) / minutes
-            rates['non_assisted_footers'][player] = data.get('non_assisted_footers', 0) / minutes
-            rates['key_passes'][player]              = data.get('key_passes', 0) / minutes
 
-        shooter_prob = {
-            'headers': _normalise(rates['headers']),
-            'footers': _normalise(rates['footers'])
-        }
-
-        assist_prob = {'headers': {}, 'footers': {}}
-
-        for shooter in active_players:
-            dist_f = {}
-            dist_f[None] = rates['non_assisted_footers'][shooter]
-            for assister in active_players:
-                if assister == shooter:
-                    continue
-                dist_f[assister] = rates['key_passes'][assister]
-            assist_prob['footers'][shooter] = _normalise(dist_f)
-
-            dist_h = {}
-            for assister in active_players:
-                if assister == shooter:
-                    continue
-                dist_h[assister] = rates['key_passes'][assister]
-            assist_prob['headers'][shooter] = _normalise(dist_h)
+    def build_player_probs(self, active_players, table):
+        # Samplers only depend on who is on the pitch, so each lineup is built once and reused across minutes and sims
+        key = (table is self.home_table, frozenset(active_players))
+        if key in self.player_probs_cache:
+            return self.player_probs_cache[key]
+        if len(self.player_probs_cache) >= self.SAMPLER_CACHE_SIZE:
+            self.player_probs_cache.clear()
 
-        return {'shooter': shooter_prob, 'assist': assist_prob}
+        # Canonical order: the cache is keyed by the set of players, so the sampler must not depend on list order.
+        # Samplers are filled on first use in get_shooter/get_assister, so lineups that never shoot cost nothing
+        ids = sorted(active_players)
+        self.player_probs_cache[key] = {'lineup': ids, 'table': table, 'shooter': {}, 'assist': {'headers': {}, 'footers': {}}}
+        return self.player_probs_cache[key]
 
     def get_shooter(self, prob_dicts, body_part):
         _body_part_key = {'Head': 'headers', 'Foot': 'footers'}
 
-        key      = _body_part_key[body_part] 
-        probs    = prob_dicts['shooter'][key]
-        players  = list(probs.keys())
-        p_vals   = list(probs.values())
-        return np.random.choice(players, p=p_vals)
-    
+        key = _body_part_key[body_part]
+
+        samplers = prob_dicts['shooter']
+        if key not in samplers:
+            table  = prob_dicts['table']
+            rates  = table.headers_rate if key == 'headers' else table.footers_rate
+            samplers[key] = AliasSampler(rates[prob_dicts['lineup']], prob_dicts['lineup'])
+        return samplers[key].draw(self.stream.uniform())
+
     def get_assister(self, prob_dicts, body_part, shooter):
         _body_part_key = {'Head': 'headers', 'Foot': 'footers'}
-        key      = _body_part_key[body_part]
-        probs    = prob_dicts['assist'][key][shooter]
-        ass      = list(probs.keys())
-        p_vals   = list(probs.values())
-        return np.random.choice(ass, p=p_vals)
+        key = _body_part_key[body_part]
+
+        samplers = prob_dicts['assist'][key]
+        if shooter not in samplers:
+            # Headers need an assister; footers can also be unassisted (None), weighted by the shooter's own non-assisted rate
+            table  = prob_dicts['table']
+            others = [p for p in prob_dicts['lineup'] if p != shooter]
+            if key == 'headers':
+                samplers[shooter] = AliasSampler(table.key_passes_rate[others], others)
+            else:
+                samplers[shooter] = AliasSampler(np.append(table.key_passes_rate[others], table.non_assisted_footers_rate[shooter]), others + [None])
+        return samplers[shooter].draw(self.stream.uniform())
+
+    def get_xg_prob(self, psxg_table, table, shooter, assister, body_part):
+        assister = table.n if assister is None else assister
+        return psxg_table[table.shooter_profile[shooter], table.assister_profile[assister], int(body_part == 'Foot')]
+
+    def _batch_scorer_weights(self, table, active, psxg, team_ra):
+        # shot_goal_weights summed over the assisters ⇒ [sim, body part, shooter]. Assisters only enter through their
+        # profile, so they are folded into per-profile totals instead of a full shooter × assister grid per sim
+        n  = table.n
+        on = active.astype(float)
+        shooter_profile = table.shooter_profile
+        assister_profile = table.assister_profile[:n]
+        unassisted_profile = table.assister_profile[n]
+
+        profiles = np.zeros((n, psxg.shape[2]))
+        profiles[np.arange(n), assister_profile] = 1.0
+        key_passes = on * table.key_passes_rate
+        key_passes_by_profile = key_passes @ profiles
+
+        rahs  = np.maximum(0, team_ra[:, 1])
+        rafs  = np.maximum(0, team_ra[:, 2])
+        total = rahs + rafs
+        p_head = np.divide(rahs, total, out=np.full(len(on), 0.5), where=total > 0)
+
+        weights = np.zeros((len(on), 2, n))
+        for body, p_body, shooter_rate, unassisted in ((0, p_head, table.headers_rate, 0.0),
+                                                       (1, 1 - p_head, table.footers_rate, table.non_assisted_footers_rate)):
+            xg    = psxg[..., body]
+            own   = xg[:, shooter_profile, assister_profile]
+            alone = xg[:, shooter_profile, unassisted_profile]
+
+            # Expected xG of a shot by each player: his teammates by key passes (never himself), plus the unassisted slot
+            chance = np.einsum('rpq,rq->rp', xg, key_passes_by_profile)[:, shooter_profile] - key_passes * own + unassisted * alone
+            weight = key_passes.sum(axis=1, keepdims=True) - key_passes + unassisted
+            no_weight = weight <= 0
+            if no_weight.any():
+                # No weight at all ⇒ uniform over teammates (and the unassisted slot for footers)
+                uniform = np.einsum('rpq,rq->rp', xg, on @ profiles)[:, shooter_profile] - on * own + body * alone
+                chance = np.where(no_weight, uniform, chance)
+                weight = np.where(no_weight, on.sum(axis=1, keepdims=True) - on + body, weight)
+
+            shooter = on * shooter_rate
+            shooter_total = shooter.sum(axis=1, keepdims=True)
+            shooter = np.where(shooter_total > 0, shooter / np.where(shooter_total > 0, shooter_total, 1), on / np.maximum(1, on.sum(axis=1, keepdims=True)))
+
+            weights[:, body] = p_body[:, None] * shooter * chance / np.maximum(weight, 1e-12)
+        return weights
+
+    def _batch_goal_details(self, table, active, weights, psxg, is_foot, rng):
+        # Scorer by his share of the body part's goal mass, then the assister by the xG of the chance he would have created
+        shooter = self._batch_pick(weights, active, rng.random(len(is_foot)))
+        assist_w, assist_allowed = self._batch_assist_options(table, active, shooter, is_foot)
+        xg_row = psxg[np.arange(len(is_foot))[:, None], table.shooter_profile[shooter][:, None], table.assister_profile[None, :], is_foot[:, None]]
+        has_weight = assist_w.sum(axis=1, keepdims=True) > 0
+        assister = self._batch_pick(np.where(has_weight, assist_w, 1.0) * xg_row, assist_allowed, rng.random(len(is_foot)))
+        return shooter, assister
+
+    def _batch_assist_options(self, table, active, shooter, is_foot):
+        # Last column is the unassisted option, only available to footers
+        n_players = active.shape[1]
+        allowed = np.zeros((len(shooter), n_players + 1), dtype=bool)
+        allowed[:, :-1] = active
+        allowed[np.arange(len(shooter)), shooter] = False
+        allowed[:, -1] = is_foot == 1
+        weights = np.empty((len(shooter), n_players + 1))
+        weights[:, :-1] = table.key_passes_rate
+        weights[:, -1] = table.non_assisted_footers_rate[shooter]
+        return np.where(allowed, weights, 0.0), allowed
+
+    def _batch_pick(self, weights, allowed, u):
+        # One weighted draw per row; rows without weight fall back to uniform over the allowed columns
+        weights = np.where(allowed, weights, 0.0)
+        cum = np.cumsum(weights, axis=1)
+        no_weight = cum[:, -1] <= 0
+        if no_weight.any():
+            cum[no_weight] = np.cumsum(allowed[no_weight], axis=1)
+        idx = (cum <= (u * cum[:, -1])[:, None]).sum(axis=1)
+        return np.minimum(idx, weights.shape[1] - 1)
+
+    def save_sim_events(self, shots, cards, schedule_id):
+        # The event records already have the store's dtypes; only the unassisted slot (table.n) becomes -1 on disk.
+        # Every shot is written, without player props the missed ones with shooter -1. Only the run summary goes to MySQL
+        records = shots.copy()
+        n_slots = np.where(shots['team'] == 0, self.home_table.n, self.away_table.n)
+        records['assister'] = np.where(shots['assister'] == n_slots, -1, shots['assister'])
+
+        scores = self.score_trajectories(shots, self.last_run['n_sims'])
+
+        SIM_STORE.write(schedule_id, {'shots': records, 'cards': cards, 'scores': scores}, {'n_sims': self.last_run['n_sims'],
+                                               'engine': self.last_run['engine'],
+                                               'standard_error': float(self.last_run['standard_error']),
+                                               'ess': self.last_run.get('raw_ess'),
+                                               'estimates': self.last_run.get('estimates'),
+                                               'home_team_id': int(self.home_team_id),
+                                               'away_team_id': int(self.away_team_id),
+                                               'home_players': list(self.home_table.player_ids),
+                                               'away_players': list(self.away_table.player_ids),
+                                               'home_yellow_before': self.home_table.sim_yellow.tolist(),
+                                               'away_yellow_before': self.away_table.sim_yellow.tolist(),
+                                               'home_reds_before': int(self.home_table.sim_red.sum()),
+                                               'away_reds_before': int(self.away_table.sim_red.sum()),
+                                               'written_at': datetime.now().isoformat()})
+
+    def score_trajectories(self, shots, n_sims):
+        # [sim, minute, home/away] ⇒ score at the end of that minute, initial goals included, so "1-0 at minute 60"
+        # is a single mask over one column instead of a rebuild from the shot rows
+        goals  = shots['outcome'] == 1
+        scores = np.zeros((n_sims, 91, 2), dtype=np.int8)
+        np.add.at(scores, (shots['sim'][goals], shots['minute'][goals], shots['team'][goals]), 1)
+        np.cumsum(scores, axis=1, out=scores)
+        scores[:, :, 0] += self.home_initial_goals
+        scores[:, :, 1] += self.away_initial_goals
+        return scores
+
+    def in_play_trajectories(self, n_sims, minute, home_goals, away_goals, sent_off=(0, 0), engine="vectorized_goals", seed=None):
+        # Score trajectories of n_sims run from the end of `minute` at this score, reusing this match's tables, models and
+        # caches instead of a new Alg. Who was sent off is not known here, so the most card-prone players on the pitch
+        # go. Substitutions due before the minute are not replayed; the ones after it still are
+        alg = Alg.from_worker_setup(self.get_worker_setup())
+        alg.match_initial_time = minute + 1
+        alg.home_initial_goals = home_goals
+        alg.away_initial_goals = away_goals
+        alg.player_props = False
+        for attr, n_off in (('home_table', sent_off[0]), ('away_table', sent_off[1])):
+            if n_off:
+                setattr(alg, attr, self._without_players(getattr(self, attr), n_off))
+        shots, _ = alg.run_simulations(n_sims, 1, engine, seed)
+        return alg.score_trajectories(shots, n_sims)
+
+    def _without_players(self, table, n_off):
+        # Same PlayerTable with the n_off starters most likely to be booked off the pitch
+        card_rate = table.fouls_committed_rate * (table.yc_prob + table.rc_prob)
+        off = table.starters[np.argsort(-card_rate[table.starters], kind='stable')[:n_off]]
+        out = PlayerTable.__new__(PlayerTable)
+        out.__dict__.update(vars(table))
+        out.starter = table.starter.copy()
+        out.starter[off] = False
+        out.starters = np.flatnonzero(out.starter)
+        for name in ('starter', 'starters'):
+            getattr(out, name).flags.writeable = False
+        return out
 
-    def insert_sim_data(self, rows, schedule_id):
-        delete_query  = """
-        DELETE FROM simulation_data 
-        WHERE schedule_id = %s
+    def insert_sim_run(self, schedule_id):
+        # Summary of the last run for this schedule; its events are in SIM_STORE
+        replace_query = """
+        REPLACE INTO simulation_runs (schedule_id, n_sims, engine, standard_error, created_at)
+        VALUES (%s, %s, %s, %s, NOW())
         """
-
-        DB.execute(delete_query, (schedule_id,))
-
-        batch_size = 200
-        for i in range(0, len(rows), batch_size):
-            chunk = rows[i:i + batch_size]
-            placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s)'] * len(chunk))
-            insert_sql = f"""
-            INSERT INTO simulation_data 
-                (sim_id, schedule_id, minute, shooter, squad, outcome, body_part, assister)
-            VALUES {placeholders}
-            """
-            params = []
-            for row in chunk:
-                params.extend([row[0], schedule_id] + list(row[1:]))
-
-            DB.execute(insert_sql, params)
+        DB.execute(replace_query, (schedule_id, self.last_run['n_sims'], self.last_run['engine'], float(self.last_run['standard_error'])))
 
     def get_referee_stats(self):
         sql = f"""
@@ -3141,36 +4549,18 @@ class Alg:
         self.none_prob_given_foul = max(0.0, 1.0 - self.yc_prob_given_foul - self.rc_prob_given_foul)
 
         self.foul_prob_cache = {}
+        self.fouler_sampler_cache = {}
 
-    def _calc_team_fouls_per90(self, active_players, opponent_players, players_data, opp_data):
-        minutes_team = sum(players_data[p]['minutes_played'] for p in active_players) or 1
-        minutes_opp  = sum(opp_data[p]['minutes_played']    for p in opponent_players) or 1
+    def _calc_team_fouls_per90(self, lineup, opponent_lineup):
+        return (lineup.fouls_committed_90 + opponent_lineup.fouls_drawn_90) / 2.0
 
-        commits_per90 = sum(
-            (players_data[p]['fouls_committed'] / max(1, players_data[p]['minutes_played'])) * 90
-            for p in active_players
-        )
-        drawn_per90 = sum(
-            (opp_data[p]['fouls_drawn'] / max(1, opp_data[p]['minutes_played'])) * 90
-            for p in opponent_players
-        )
-
-        return (commits_per90 + drawn_per90) / 2.0
-
-    def get_team_foul_prob(self, active_players, opponent_players, status, is_home):
+    def get_team_foul_prob(self, lineup, opponent_lineup, status, is_home):
         if isinstance(status, (int, float)):
             status = 1 if status > 0 else -1 if status < 0 else 0
-        key = (frozenset(active_players), frozenset(opponent_players), status, is_home)
+        key = (lineup.key, opponent_lineup.key, status, is_home)
         if key not in self.foul_prob_cache:
-            players_data = self.home_players_data if is_home else self.away_players_data
-            opp_data     = self.away_players_data if is_home else self.home_players_data
-
-            team_f90  = self._calc_team_fouls_per90(active_players, opponent_players,
-                                                    players_data, opp_data)
-            
-            opp_f90  = self._calc_team_fouls_per90(opponent_players,
-                                                active_players,
-                                                opp_data, players_data)
+            team_f90 = self._calc_team_fouls_per90(lineup, opponent_lineup)
+            opp_f90  = self._calc_team_fouls_per90(opponent_lineup, lineup)
 
             sum_f90      = team_f90 + opp_f90
             normaliser   = (sum_f90 + self.ref_fouls_pm) / 2.0
@@ -3183,46 +4573,93 @@ class Alg:
             self.foul_prob_cache[key] = max(per_min, 1e-6)   # keep ≥ very small
         return self.foul_prob_cache[key]
     
-    def choose_fouler(self, active_players, players_dict):
-        weights = [(players_dict[p]['fouls_committed'] / max(1, players_dict[p]['minutes_played']))
-                   for p in active_players]
-        total = sum(weights)
-        if total == 0:
-            weights = [1 / len(active_players)] * len(active_players)
-        else:
-            weights = [w / total for w in weights]
-        return np.random.choice(active_players, p=weights)
-    
-    def determine_card(self, player_id, players_dict, k: int = 10):
-        pdata = players_dict[player_id]
-
-        fouls = pdata.get('fouls_committed', 0)
-        ycs   = pdata.get('yellow_cards',     0)
-        rcs   = pdata.get('red_cards',        0)
-
-        player_yc_rate = (ycs + k * self.yc_prob_given_foul) / (fouls + k)
-        player_rc_rate = (rcs + k * self.rc_prob_given_foul) / (fouls + k)
+    def choose_fouler(self, lineup):
+        key = (lineup.table is self.home_table, lineup.key)
+        if key not in self.fouler_sampler_cache:
+            if len(self.fouler_sampler_cache) >= self.SAMPLER_CACHE_SIZE:
+                self.fouler_sampler_cache.clear()
+            players = sorted(lineup.players)
+            self.fouler_sampler_cache[key] = AliasSampler(lineup.table.fouls_committed_rate[players], players)
+        return self.fouler_sampler_cache[key].draw(self.stream.uniform())
+
+    def determine_card(self, player, table):
+        # Per-player YC/RC split given a foul is precomputed in PlayerTable
+        u = self.stream.uniform()
+        if u < table.yc_prob[player]:
+            return 'YC'
+        if u < table.yc_prob[player] + table.rc_prob[player]:
+            return 'RC'
+        return 'NONE'
+
+_SIM_WORKER = None
+
+def _init_sim_worker(setup):
+    global _SIM_WORKER
+    _SIM_WORKER = Alg.from_worker_setup(setup)
+
+def _run_sim_chunk(chunk):
+    return _SIM_WORKER.simulate_chunk(*chunk)
+
+_SERVICE_SETUPS = {}
+
+def _run_service_chunk(task):
+    # Service workers outlive a match: each setup is loaded from disk once per worker and kept for the next chunks
+    key, path, chunk = task
+    alg = _SERVICE_SETUPS.get(key)
+    if alg is None:
+        if len(_SERVICE_SETUPS) >= SimulationService.WORKER_SETUPS:
+            _SERVICE_SETUPS.clear()
+        with open(path, "rb") as f:
+            alg = Alg.from_worker_setup(pickle.load(f))
+        _SERVICE_SETUPS[key] = alg
+    return alg.simulate_chunk(*chunk)
+
+class SimulationService:
+    """
+    Long-lived process pool for Alg simulations, so back to back fixtures skip pool startup and module imports.
 
-        weight_player = 0.5
-        weight_ref    = 1.0 - weight_player
+    The pool is forked once (create it from the main thread, before any worker threads start). Each match setup is
+    pickled to a temporary file that workers load on their first chunk of that match; chunk results stream back in order.
+    Alg.run_simulations uses it through session(), which keeps one setup file alive across adaptive rounds.
 
-        yc_prob = weight_player * player_yc_rate + weight_ref * self.yc_prob_given_foul
-        rc_prob = weight_player * player_rc_rate + weight_ref * self.rc_prob_given_foul
+    Usage Example:
+    service = SimulationService(n_workers=8)
+    alg = Alg(..., engine="vectorized", service=service)    # runs its chunks on the warm pool
+    service.close()
+    """
+    WORKER_SETUPS = 4
 
-        total = yc_prob + rc_prob
-        if total > 1.0:
-            yc_prob /= total
-            rc_prob /= total
-            total = 1.0
+    def __init__(self, n_workers=None):
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.pool = multiprocessing.Pool(processes=self.n_workers)
+        self.matches = 0
 
-        none_prob = 1.0 - total 
-        probs     = [yc_prob, rc_prob, none_prob]
+    @contextmanager
+    def session(self, setup):
+        # One match: the setup is written once, and run(chunks) can be called for as many rounds as needed
+        key = uuid.uuid4().hex
+        fd, path = tempfile.mkstemp(prefix="vpfm_sim_", suffix=".pkl")
+        rounds = []
 
-        probs = [max(p, 0.0) for p in probs]
-        probs = np.array(probs) / np.sum(probs)
+        def run(chunks):
+            rounds.append(self.pool.imap(_run_service_chunk, [(key, path, chunk) for chunk in chunks]))
+            return rounds[-1]
 
-        outcome = np.random.choice(['YC', 'RC', 'NONE'], p=probs)
-        return outcome
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(setup, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.matches += 1
+            yield run
+        finally:
+            # A run that stopped early can leave chunks in flight; let them finish before their setup file goes
+            for results in rounds:
+                for _ in results:
+                    pass
+            os.remove(path)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
 
 # ------------------------------ Automatization ------------------------------
 class AutoLineups:
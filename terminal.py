@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
 import sys
-from PyQt5.QtCore import Qt, QRunnable, QObject, pyqtSignal, QThreadPool, QDate
+from PyQt5.QtCore import Qt, QRunnable, QObject, pyqtSignal, QThreadPool, QDate, QTimer
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QHBoxLayout, QVBoxLayout,
                             QComboBox, QScrollArea, QLabel, QPushButton, QCheckBox, QDoubleSpinBox,
                             QDialog, QListWidget, QListWidgetItem, QTabWidget, QFormLayout, QPlainTextEdit, QHeaderView,
@@ -9,13 +9,13 @@ from functools import partial
 import core
 import warnings 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
-import pandas as pd
+import numpy as np
 
 class WorkerSignals(QObject):
     finished = pyqtSignal() 
     error = pyqtSignal(tuple) 
     result = pyqtSignal(object)
-    progress = pyqtSignal(int)
+    progress = pyqtSignal(object)
 
 class UpdateWorker(QRunnable):
     def __init__(self, fn, *args, **kwargs):
@@ -37,12 +37,18 @@ class UpdateWorker(QRunnable):
             self.signals.finished.emit()
 
 class MainWindow(QMainWindow):
+    SIM_ALGS_KEPT = 3
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Venomio Probabilistic Football Model v7")
         self.setGeometry(100, 100, 1920, 1080)
         self.showMaximized()
         self.threadpool = QThreadPool()
+        self.sim_service = core.SimulationService()
+        # Last Alg built per schedule, kept for the small in-play top-up runs of the odds tab. Only the most recent
+        # SIM_ALGS_KEPT builds are kept, each holds its match's tables and caches
+        self.sim_algs = {}
         self.open_windows = []
         
         self.vpfm_db = core.DB
@@ -331,6 +337,12 @@ class MainWindow(QMainWindow):
         saved_referee = core.get_referee_name(match['schedule_id'])
         if saved_referee:
             self.referee_input.setText(saved_referee)
+
+        # Without player props every shot is still stored but only goals keep a shooter and assister. The vectorized
+        # engine then skips the per-shot draws; the per-sim engines still make them
+        self.player_props_chk = QCheckBox("Player props")
+        self.player_props_chk.setStyleSheet("color: white;")
+        form_layout.addRow(self.player_props_chk)
         
         home_players_label = QLabel(f"{match['home_team']} Players:")
         home_players_label.setStyleSheet("color: white;")
@@ -565,11 +577,24 @@ class MainWindow(QMainWindow):
                 match_initial_time=match_initial_time,
                 home_n_subs_avail=home_initial_n_subs,
                 away_n_subs_avail=away_initial_n_subs,
-                referee_name=referee_name
+                referee_name=referee_name,
+                engine="vectorized",
+                service=self.sim_service,
+                player_props=self.player_props_chk.isChecked()
             )
+            # Partial score tables come back after every chunk, so the odds tab prices the run while it is going
+            worker.kwargs['on_progress'] = worker.signals.progress.emit
+            worker.signals.progress.connect(on_sim_progress)
             worker.signals.finished.connect(lambda: self.remove_task_from_queue(list_item))
+            worker.signals.finished.connect(on_sim_finished)
             worker.signals.error.connect(lambda err: print("Simulation error:", err))
-            worker.signals.result.connect(lambda res: print("Simulation finished with result:", res))
+            def on_sim_result(res):
+                self.sim_algs.pop(int(match['schedule_id']), None)
+                self.sim_algs[int(match['schedule_id'])] = res
+                while len(self.sim_algs) > self.SIM_ALGS_KEPT:
+                    self.sim_algs.pop(next(iter(self.sim_algs)))
+                print("Simulation finished with result:", res, "| sims:", res.last_run, "| model cache:", core.MODEL_REGISTRY.stats())
+            worker.signals.result.connect(on_sim_result)
             self.threadpool.start(worker)
         
         self.submit_button.clicked.connect(run_build_game)
@@ -630,6 +655,19 @@ class MainWindow(QMainWindow):
         goals_frame.addLayout(away_goals_layout)
         sim_params_layout.addLayout(goals_frame)
 
+        reds_frame = QHBoxLayout()
+        home_reds_spin = QSpinBox()
+        home_reds_spin.setRange(0, 4)
+        home_reds_spin.setPrefix("Sent off: ")
+        home_reds_spin.valueChanged.connect(lambda _: update_odds())
+        away_reds_spin = QSpinBox()
+        away_reds_spin.setRange(0, 4)
+        away_reds_spin.setPrefix("Sent off: ")
+        away_reds_spin.valueChanged.connect(lambda _: update_odds())
+        reds_frame.addWidget(home_reds_spin)
+        reds_frame.addWidget(away_reds_spin)
+        sim_params_layout.addLayout(reds_frame)
+
         # xG
         xg_frame = QHBoxLayout()
         home_xg_label = QLabel(f"<span style='color:#FFFFFF;'>xG: </span> <span style='color:#138585;'>N/A</span>")
@@ -652,10 +690,13 @@ class MainWindow(QMainWindow):
         match_odds_layout.addRow("Away:", away_odds_label)
         draw_odds_label = QLabel('0')
         match_odds_layout.addRow("Draw:", draw_odds_label)
+        sims_label = QLabel('0')
+        match_odds_layout.addRow("Sims:", sims_label)
         odds_layout.addWidget(match_odds_group)
         home_odds_label.setStyleSheet("color: #138585;")
         away_odds_label.setStyleSheet("color: #138585;")
         draw_odds_label.setStyleSheet("color: #138585;")
+        sims_label.setStyleSheet("color: #138585;")
 
         # --- Asian Handicap Section ---
         asian_group = QGroupBox("Asian Handicap")
@@ -748,104 +789,141 @@ class MainWindow(QMainWindow):
 
         odds_layout.addWidget(team_totals_group)
 
-        def get_aggregated_goals(shots_df, home_team_id, away_team_id):
-            if shots_df is None or shots_df.empty:
-                return pd.DataFrame(columns=['sim_id', 'minute', 'home_goals', 'away_goals'])
-            
-            df = shots_df.copy()
-            
-            df = df.sort_values(['sim_id', 'minute']).reset_index(drop=True)
-            
-            df['squad']   = pd.to_numeric(df['squad'],   errors='coerce').astype('Int64')
-            df['outcome'] = pd.to_numeric(df['outcome'], errors='coerce').fillna(0).astype(int)
-            
-            df['is_home']   = df['squad'] == int(home_team_id)
-            df['home_goal'] = ((df['outcome'] == 1) &  df['is_home']).astype(int)
-            df['away_goal'] = ((df['outcome'] == 1) & ~df['is_home']).astype(int)
-            
-            df['home_goal_cum'] = df.groupby('sim_id')['home_goal'].cumsum()
-            df['away_goal_cum'] = df.groupby('sim_id')['away_goal'].cumsum()
-            
-            agg = (
-                df.groupby(['sim_id', 'minute'])
-                .agg(home_goals=('home_goal_cum', 'last'),
-                    away_goals=('away_goal_cum', 'last'))
-                .reset_index()
-            )
-            
-            max_minute = int(df['minute'].max())
-            full_index = pd.MultiIndex.from_product(
-                [agg['sim_id'].unique(), range(max_minute + 1)],
-                names=['sim_id', 'minute']
-            )
-            
-            agg = (
-                agg.set_index(['sim_id', 'minute'])
-                .reindex(full_index)
-                .groupby(level=0)
-                .ffill()
-                .fillna(0)
-                .reset_index()
-            )
-            
-            return agg
-
-        simulation_data = None
-        aggregated_df   = pd.DataFrame() 
+        # --- Cards Section ---
+        cards_group = QGroupBox("Cards")
+        cards_group.setStyleSheet("font-weight: bold;")
+        cards_layout = QFormLayout(cards_group)
+        home_cards_label = QLabel('0')
+        cards_layout.addRow("Home Cards:", home_cards_label)
+        away_cards_label = QLabel('0')
+        cards_layout.addRow("Away Cards:", away_cards_label)
+        cards_dropdown = QComboBox()
+        cards_dropdown.addItems(["2.5", "3.5", "4.5", "5.5", "6.5"])
+        cards_layout.addRow("Total", cards_dropdown)
+        cards_under_odds = QLabel('0')
+        cards_layout.addRow("Under:", cards_under_odds)
+        cards_over_odds = QLabel('0')
+        cards_layout.addRow("Over:", cards_over_odds)
+        sent_off_odds = QLabel('0')
+        cards_layout.addRow("Sending Off:", sent_off_odds)
+        for label in (home_cards_label, away_cards_label, cards_under_odds, cards_over_odds, sent_off_odds):
+            label.setStyleSheet("color: #138585;")
+
+        odds_layout.addWidget(cards_group)
+
+        simulation_scores = None
+        simulation_meta   = None
+        simulation_n      = None
+        # Running final-score table of a build still simulating, priced until the finished run is stored
+        live_run          = {}
         def load_simulation_data():
-            nonlocal simulation_data, aggregated_df
+            nonlocal simulation_scores, simulation_meta, simulation_n
             schedule_id = int(match['schedule_id']) 
-            sql_query = "SELECT * FROM simulation_data WHERE schedule_id = %s"
-            simulation_data = self.vpfm_db.select(sql_query, (schedule_id,))
-
-            aggregated_df = get_aggregated_goals(
-                simulation_data,
-                int(match['home_team_id']),
-                int(match['away_team_id'])
-            )
+            simulation_meta = core.SIM_STORE.read_meta(schedule_id)
+            # [sim, minute, home/away] score trajectories, memory-mapped from the store
+            simulation_scores = core.SIM_STORE.open(schedule_id, "scores")
+            simulation_n = simulation_meta['n_sims'] if simulation_meta else None
         load_simulation_data()
 
-        def update_odds():
-            nonlocal aggregated_df
-            if aggregated_df.empty:
+        def get_score_histogram(current_minute, home_goals, away_goals, reds, max_minute):
+            # Stored sims in this state at the end of the minute, plus a top-up once one has run for it
+            return core.IN_PLAY.final_counts(int(match['schedule_id']), current_minute, home_goals, away_goals, reds, max_minute)
+
+        # When too few stored sims match and this match was built in this session, its Alg tops them up with a short
+        # run from the state. That run goes to the thread pool once the spinners have settled, so scrubbing the
+        # minute only ever prices the matched sims
+        top_ups_running = set()
+        top_up_timer = QTimer(odds_tab)
+        top_up_timer.setSingleShot(True)
+        top_up_timer.setInterval(500)
+
+        def start_top_up():
+            schedule_id = int(match['schedule_id'])
+            alg = self.sim_algs.get(schedule_id)
+            if alg is None or live_run or simulation_scores is None:
                 return
-            
-            aggregated_df = get_aggregated_goals(
-                simulation_data,
-                int(match['home_team_id']),
-                int(match['away_team_id'])
-            )         
+            state = (current_minute_spin.value(), home_goals_spin.value(), away_goals_spin.value(), (home_reds_spin.value(), away_reds_spin.value()))
+            if state in top_ups_running:
+                return
+            top_ups_running.add(state)
+            worker = UpdateWorker(core.IN_PLAY.top_up, schedule_id, *state,
+                                  lambda n: alg.in_play_trajectories(n, *state))
+            worker.signals.error.connect(lambda err: print("In-play top-up error:", err))
+            worker.signals.finished.connect(lambda: top_ups_running.discard(state))
+            worker.signals.finished.connect(update_odds)
+            self.threadpool.start(worker)
+
+        top_up_timer.timeout.connect(start_top_up)
+
+        def update_card_odds():
+            cards = core.SIM_STORE.open(int(match['schedule_id']), "cards")
+            if cards is None or not simulation_n:
+                return
+
+            # Cards are priced over the whole simulated match, straight from the memory-mapped columns
+            distribution = core.card_count_distribution(cards, simulation_n)
+            players = core.player_card_probabilities(
+                cards, simulation_n,
+                (len(simulation_meta['home_players']), len(simulation_meta['away_players'])),
+                (np.array(simulation_meta['home_yellow_before']), np.array(simulation_meta['away_yellow_before']))
+            )
+            k = np.arange(distribution.shape[1])
+            home_cards_label.setText(str(round(float(distribution[0] @ k), 3)))
+            away_cards_label.setText(str(round(float(distribution[1] @ k), 3)))
+
+            cards_line = float(cards_dropdown.currentText())
+            p_under = distribution[2][k < cards_line].sum()
+            p_over  = distribution[2][k > cards_line].sum()
+            cards_under_odds.setText(str(round(1 / p_under, 3)) if p_under > 0 else '0')
+            cards_over_odds.setText(str(round(1 / p_over, 3)) if p_over > 0 else '0')
+            sent_off_odds.setText(str(round(1 / players['any_sent_off'], 3)) if players['any_sent_off'] > 0 else '0')
+
+        cards_dropdown.currentIndexChanged.connect(update_card_odds)
+        update_card_odds()
+
+        def on_sim_progress(update):
+            live_run.update(update)
+            update_odds()
+
+        def on_sim_finished():
+            live_run.clear()
+            load_simulation_data()
+            update_card_odds()
+            update_odds()
 
-            current_minute = current_minute_spin.value()
-            max_minute = max_minute_spin.value()
-            home_goals = home_goals_spin.value()
-            away_goals = away_goals_spin.value()
+        def update_odds():
+            if live_run:
+                # Full-time table of the build's own starting state, whatever the spinners say
+                final_counts = live_run['score_counts']
+            else:
+                if simulation_scores is None:
+                    return
 
-            filtered_data = aggregated_df[
-                (aggregated_df['minute'] == current_minute) & 
-                (aggregated_df['home_goals'] == home_goals) & 
-                (aggregated_df['away_goals'] == away_goals)
-            ]
+                current_minute = current_minute_spin.value()
+                max_minute = max_minute_spin.value()
+                home_goals = home_goals_spin.value()
+                away_goals = away_goals_spin.value()
 
-            relevant_sim_ids = filtered_data['sim_id'].unique()
+                reds = (home_reds_spin.value(), away_reds_spin.value())
 
-            final_data = aggregated_df[
-                (aggregated_df['minute'] == max_minute) &
-                (aggregated_df['sim_id'].isin(relevant_sim_ids))
-            ]
+                # [home, away] final score counts of the sims that were at this score and sendings-off at current_minute
+                final_counts, in_play_info = get_score_histogram(current_minute, home_goals, away_goals, reds, max_minute)
+                if in_play_info['missing'] and int(match['schedule_id']) in self.sim_algs:
+                    top_up_timer.start()
+            final_home, final_away = np.indices(final_counts.shape)
 
-            total_final_data = len(final_data)
+            total_final_data = int(final_counts.sum())
 
             # --- xG ---
-            total_home_goals = final_data["home_goals"].sum() / total_final_data if total_final_data != 0 else 0
-            total_away_goals = final_data["away_goals"].sum() / total_final_data if total_final_data != 0 else 0
+            total_home_goals = (final_counts * final_home).sum() / total_final_data if total_final_data != 0 else 0
+            total_away_goals = (final_counts * final_away).sum() / total_final_data if total_final_data != 0 else 0
             home_xg_label.setText(f"<span style='color:#FFFFFF;'>xG: </span> <span style='color:#138585;'>{round(total_home_goals, 3)}</span>")
             away_xg_label.setText(f"<span style='color:#FFFFFF;'>xG: </span> <span style='color:#138585;'>{round(total_away_goals, 3)}</span>")
 
             # --- Match Odds ---
-            home_wins = len(final_data[final_data['home_goals'] > final_data['away_goals']])
-            away_wins = len(final_data[final_data['home_goals'] < final_data['away_goals']])
-            draws = len(final_data[final_data['home_goals'] == final_data['away_goals']])
+            home_wins = final_counts[final_home > final_away].sum()
+            away_wins = final_counts[final_home < final_away].sum()
+            draws = final_counts[final_home == final_away].sum()
 
             home_odds = round(1 / (home_wins / total_final_data ), 3) if total_final_data != 0 and home_wins != 0 else 0
             draw_odds = round(1 / (draws / total_final_data ), 3)  if total_final_data != 0 and draws != 0 else 0
@@ -853,25 +931,35 @@ class MainWindow(QMainWindow):
             home_odds_label.setText(str(home_odds))
             away_odds_label.setText(str(away_odds))
             draw_odds_label.setText(str(draw_odds))
+            # Sims behind these prices, and the plain Monte Carlo size the whole run is worth (antithetic pairs count more)
+            if live_run:
+                sims_label.setText(f"Live: {live_run['n_sims']} / {live_run['max_sims']} | SE: {live_run['standard_error']:.4f}")
+            else:
+                ess = simulation_meta.get('ess') if simulation_meta else None
+                if in_play_info['top_up']:
+                    top_up_text = f" (+{in_play_info['top_up']} top-up)"
+                elif in_play_info['missing'] and int(match['schedule_id']) in self.sim_algs:
+                    top_up_text = " (topping up...)"
+                else:
+                    top_up_text = ""
+                sims_label.setText(f"{in_play_info['matched']}{top_up_text} / {simulation_n}" + (f" | ESS: {int(ess)}" if ess else ""))
 
             # --- Totals (Over/Under) ---
             teams_totals = float(totals_dropdown.currentText())
-            count_teams_under = len(final_data[final_data['home_goals'] + final_data['away_goals'] < teams_totals])
-            count_teams_over = len(final_data[final_data['home_goals'] + final_data['away_goals'] > teams_totals])
+            count_teams_under = final_counts[final_home + final_away < teams_totals].sum()
+            count_teams_over = final_counts[final_home + final_away > teams_totals].sum()
             under_teams_odds = round(1 / (count_teams_under / total_final_data), 3)   if total_final_data != 0 and count_teams_under != 0 else 0
             over_teams_odds = round(1 / (count_teams_over / total_final_data), 3)  if total_final_data != 0 and count_teams_over != 0 else 0
             under_odds_label.setText(str(under_teams_odds))
             over_odds_label.setText(str(over_teams_odds))
 
             # --- Correct Score ---
-            score_counts = final_data.groupby(['home_goals', 'away_goals']).size()
-
             for score in correct_score_labels.keys():
                 if "Any Other" in score:
                     continue
 
                 home_goals, away_goals = map(int, score.replace(" ", "").split("-"))
-                count = score_counts.get((home_goals, away_goals), 0)
+                count = final_counts[home_goals, away_goals]
                 odds = round(1 / (count / total_final_data), 3)  if total_final_data != 0 and count != 0 else 0
 
                 if odds == 0:
@@ -883,9 +971,9 @@ class MainWindow(QMainWindow):
 
                 correct_score_labels[score].setText(f"<span style='color:#FFFFFF;'>{score}:</span> {odds_str}")
 
-            any_other_home_win = sum(score_counts[(h, a)] for h in range(4, 11) for a in range(0, 4) if (h, a) in score_counts)
-            any_other_away_win = sum(score_counts[(h, a)] for h in range(0, 4) for a in range(4, 11) if (h, a) in score_counts)
-            any_other_draw = sum(score_counts[(h, h)] for h in range(4, 11) if (h, h) in score_counts)
+            any_other_home_win = final_counts[4:, :4].sum()
+            any_other_away_win = final_counts[:4, 4:].sum()
+            any_other_draw = np.diagonal(final_counts)[4:].sum()
 
             aggregated_home_odds = round(1 / (any_other_home_win / total_final_data), 3) if total_final_data != 0 and any_other_home_win != 0 else 10**30
             aggregated_away_odds = round(1 / (any_other_away_win / total_final_data), 3) if total_final_data != 0 and any_other_away_win != 0 else 10**30
@@ -908,11 +996,11 @@ class MainWindow(QMainWindow):
             handicap_str = asian_dropdown.currentText() 
             handicap_val = float(handicap_str.replace("+", "").replace("-", ""))
             if handicap_str.startswith("+"):
-                home_asian_wins = len(final_data[final_data['home_goals'] + handicap_val > final_data['away_goals']])
-                away_asian_wins = len(final_data[final_data['away_goals'] - handicap_val > final_data['home_goals']])
+                home_asian_wins = final_counts[final_home + handicap_val > final_away].sum()
+                away_asian_wins = final_counts[final_away - handicap_val > final_home].sum()
             elif handicap_str.startswith("-"):
-                home_asian_wins = len(final_data[final_data['home_goals'] - handicap_val > final_data['away_goals']])
-                away_asian_wins = len(final_data[final_data['away_goals'] + handicap_val > final_data['home_goals']])
+                home_asian_wins = final_counts[final_home - handicap_val > final_away].sum()
+                away_asian_wins = final_counts[final_away + handicap_val > final_home].sum()
             home_asian_odds = round(1 / (home_asian_wins / total_final_data), 3) if total_final_data != 0 and home_asian_wins != 0 else 0
             away_asian_odds = round(1 / (away_asian_wins / total_final_data), 3) if total_final_data != 0 and away_asian_wins != 0 else 0
             home_asian_odds_label.setText(str(home_asian_odds))
@@ -920,8 +1008,8 @@ class MainWindow(QMainWindow):
 
             # -- Home Totals --
             home_threshold = float(home_totals_dropdown.currentText())
-            count_home_under = len(final_data[final_data['home_goals'] < home_threshold])
-            count_home_over = len(final_data[final_data['home_goals']  > home_threshold])
+            count_home_under = final_counts[final_home < home_threshold].sum()
+            count_home_over = final_counts[final_home > home_threshold].sum()
             under_home_odds = round(1 / (count_home_under / total_final_data), 3) if total_final_data != 0 and count_home_under != 0 else 0
             over_home_odds = round(1 / (count_home_over / total_final_data), 3) if total_final_data != 0 and count_home_over != 0 else 0
             home_team_totals_under_odds.setText(str(under_home_odds))
@@ -929,8 +1017,8 @@ class MainWindow(QMainWindow):
 
             # -- Away Totals --
             away_threshold = float(away_totals_dropdown.currentText())
-            count_away_under = len(final_data[final_data['away_goals'] < away_threshold])
-            count_away_over = len(final_data[final_data['away_goals']  > away_threshold])
+            count_away_under = final_counts[final_away < away_threshold].sum()
+            count_away_over = final_counts[final_away > away_threshold].sum()
             under_away_odds = round(1 / (count_away_under / total_final_data), 3) if total_final_data != 0 and count_away_under != 0 else 0
             over_away_odds = round(1 / (count_away_over / total_final_data), 3) if total_final_data != 0 and count_away_over != 0 else 0
             away_team_totals_under_odds.setText(str(under_away_odds))
@@ -1990,6 +2078,7 @@ class MainWindow(QMainWindow):
         print("Arbitrage opened.")
 
     def closeEvent(self, event):
+        self.sim_service.close()
         self.worker.stop()
         event.accept()
 
@@ -0,0 +1,201 @@
+import numpy as np
+
+import core
+
+
+def _players_data(team, n_players, seed):
+    rng = np.random.default_rng(seed)
+    players = {}
+    for i in range(n_players):
+        player = {'minutes_played': rng.uniform(300, 2500),
+                  'headers': rng.uniform(0, 15),
+                  'footers': rng.uniform(0, 40),
+                  'non_assisted_footers': rng.uniform(0, 15),
+                  'key_passes': rng.uniform(0, 30),
+                  'fouls_committed': rng.uniform(5, 40),
+                  'fouls_drawn': rng.uniform(5, 40),
+                  'yellow_cards': rng.integers(0, 8),
+                  'red_cards': rng.integers(0, 2),
+                  'sq': round(rng.uniform(0.05, 0.2), 2),
+                  'shooter_A': round(rng.uniform(-0.5, 0.5), 1),
+                  'in_status_prob': dict(zip(core.PlayerTable.STATUS_COLUMNS, rng.dirichlet(np.ones(3)))),
+                  'out_status_prob': dict(zip(core.PlayerTable.STATUS_COLUMNS, rng.dirichlet(np.ones(3)))),
+                  'sim_yellow': 0,
+                  'sim_red': False}
+        for c in core.PlayerTable.COEF_TYPES:
+            player[f'off_{c}_coef'] = rng.uniform(0.008, 0.016) if c == 'sh' else rng.uniform(0.002, 0.008)
+            player[f'def_{c}_coef'] = rng.uniform(0.0, 0.002)
+        players[f'{team}-{i}'] = player
+    return players
+
+
+def _flat_psxg_table(table, plhsq, plfsq, status, is_home):
+    return np.full((len(table.shooter_profiles), len(table.assister_profiles), 2), 0.11)
+
+
+def _flat_psxg_tables(table, plhsq, plfsq, status, is_home):
+    return np.full((len(plhsq), len(table.shooter_profiles), len(table.assister_profiles), 2), 0.11)
+
+
+def _synthetic_alg(match_initial_time=0, home_sub_minutes=None, away_sub_minutes=None):
+    # An Alg without the database or the boosters: synthetic PlayerTables, flat context multipliers and one psxg table
+    alg = object.__new__(core.Alg)
+    alg.ref_stats = {'fouls': 26.5, 'yellow_cards': 3.8, 'red_cards': 0.14, 'matches_played': 1}
+    alg.precompute_card_sim_data()
+
+    for side, seed in (('home', 1), ('away', 2)):
+        players = _players_data(side, 16, seed)
+        ids = list(players)
+        setattr(alg, f'{side}_table', core.PlayerTable(players, ids[:11], ids[11:], alg.yc_prob_given_foul, alg.rc_prob_given_foul))
+    alg.home_team_id, alg.away_team_id = 1, 2
+
+    flat = {(st, sg, 0): 1.0 for st in core.Alg.STATUS_VALUES for sg in range(1, 7)}
+    alg.ctx_mult_home, alg.ctx_mult_away = flat, flat
+    alg.get_psxg_table = _flat_psxg_table
+    alg.build_psxg_tables = _flat_psxg_tables
+
+    alg.home_initial_goals = alg.away_initial_goals = 0
+    alg.match_initial_time = match_initial_time
+    alg.home_sub_minutes = home_sub_minutes or {60: 2, 75: 1}
+    alg.away_sub_minutes = away_sub_minutes or {65: 3}
+    alg.all_sub_minutes = list(set(list(alg.home_sub_minutes.keys()) + list(alg.away_sub_minutes.keys())))
+    alg.scheduled_minutes = sorted(set([16, 31, 46, 61, 76] + alg.all_sub_minutes))
+
+    alg.player_props, alg.antithetic, alg.sampling = True, False, "random"
+    alg.stream = core.RandomStream()
+    alg.player_probs_cache, alg.lineup_state_cache = {}, {}
+    alg.rsq_pred_cache, alg.psxg_pred_cache, alg.psxg_table_cache = {}, {}, {}
+    alg.lineup_state_hits = alg.lineup_state_misses = 0
+    return alg
+
+
+def test_event_driven_engine_matches_minute_loop():
+    alg = _synthetic_alg()
+    summary = alg.compare_engines(2000, engines=("loop", "events"), seed=11)
+    assert summary['score_table_p_value'] > 0.01
+    assert abs(summary['loop']['shots_per_sim'] - summary['events']['shots_per_sim']) < 1.0
+
+
+def test_no_subs_sentinel_stops_at_full_time():
+    alg = _synthetic_alg(match_initial_time=80, home_sub_minutes={100: 0}, away_sub_minutes={100: 0})
+    assert alg.next_scheduled_minute(85) == 91
+
+    for engine in ("events", "vectorized_goals"):
+        shots, cards = alg.run_simulations(500, 1, engine, seed=3)
+        assert shots['minute'].max(initial=0) <= 90
+        assert cards['minute'].max(initial=0) <= 90
+        assert alg.score_trajectories(shots, alg.last_run['n_sims']).shape == (500, 91, 2)
+
+
+def test_results_do_not_depend_on_worker_count():
+    for engine, n_sims in (("loop", 1200), ("vectorized", 4500)):
+        alg = _synthetic_alg()
+        shots, cards = alg.run_simulations(n_sims, 1, engine, seed=5)
+        pooled_shots, pooled_cards = alg.run_simulations(n_sims, 3, engine, seed=5)
+        np.testing.assert_array_equal(pooled_shots, shots)
+        np.testing.assert_array_equal(pooled_cards, cards)
+
+
+def test_exact_distribution_matches_goal_simulation():
+    # The exact engine leaves red cards out and plays substitutions as expected lineups, hence the tolerance
+    alg = _synthetic_alg()
+    exact = alg._score_markets(alg.exact_score_distribution()['final'])
+    alg.run_simulations(20000, 1, "vectorized_goals", seed=2)
+    counts = alg.last_run['score_counts']
+    simulated = alg._score_markets(counts / counts.sum())
+    for market in ('home_win', 'draw', 'away_win', 'over_1_5', 'over_2_5', '0-0', '1-1'):
+        assert abs(exact[market] - simulated[market]) < 0.015, market
+
+    # Sampled substitution picks stand in for the enumeration once it gets too long
+    exact_swap = alg._expected_swap(alg.home_table, alg.home_table.starter.astype(float), 3, np.array([0.3, 0.4, 0.3]))
+    alg.EXACT_SWAP_ORDERINGS = 10
+    sampled_swap = alg._expected_swap(alg.home_table, alg.home_table.starter.astype(float), 3, np.array([0.3, 0.4, 0.3]))
+    np.testing.assert_allclose(sampled_swap, exact_swap, atol=0.02)
+
+
+def _score_trajectories(n_sims, seed):
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.random((n_sims, 91, 2)) < 0.015, axis=1).astype(np.int8)
+
+
+def test_conditional_score_cube_matches_masks():
+    scores = _score_trajectories(3000, 0)
+    sent_off = {'sim': np.array([0, 5, 5, 9]), 'minute': np.array([20, 30, 60, 89]), 'team': np.array([0, 1, 1, 0])}
+    reds = core.sent_off_by_minute(sent_off, 3000)
+    assert reds[5, 59, 1] == 1 and reds[5, 60, 1] == 2 and reds[5, 29].sum() == 0
+
+    cube = core.conditional_score_cube(scores, reds, to_minute=80)
+    for minute, home, away, state_reds in ((0, 0, 0, (0, 0)), (45, 1, 0, (0, 0)), (70, 1, 1, (0, 0)), (65, 0, 0, (0, 2))):
+        in_state = ((scores[:, minute, 0] == home) & (scores[:, minute, 1] == away) &
+                    (reds[:, minute, 0] == state_reds[0]) & (reds[:, minute, 1] == state_reds[1]))
+        expected = np.zeros((11, 11), dtype=np.int64)
+        np.add.at(expected, (scores[in_state, 80, 0], scores[in_state, 80, 1]), 1)
+        np.testing.assert_array_equal(core.conditional_counts(cube, minute, home, away, state_reds), expected)
+
+
+def _stored_run(tmp_path, n_sims=2000):
+    store = core.SimulationStore(str(tmp_path))
+    cards = np.array([(3, 10, 0, 2, 1), (7, 40, 1, 4, 0), (7, 55, 1, 4, 0), (8, 50, 0, 1, 0)], dtype=core.SimulationStore.DTYPES['cards'])
+    store.write(1, {'shots': np.empty(0, dtype=core.SimulationStore.DTYPES['shots']), 'cards': cards, 'scores': _score_trajectories(n_sims, 1)},
+                {'n_sims': n_sims, 'home_players': list('abcdefghijklmn'), 'away_players': list('opqrstuvwxyzAB'),
+                 'home_yellow_before': [0] * 14, 'away_yellow_before': [0] * 14, 'home_reds_before': 0, 'away_reds_before': 0,
+                 'written_at': 'now'})
+    return store
+
+
+def test_in_play_pricer_counts_and_top_up(tmp_path):
+    store = _stored_run(tmp_path)
+    scores = store.open(1, "scores")
+    pricer = core.InPlayPricer(store, min_sims=500)
+
+    counts, info = pricer.final_counts(1, 45, 0, 0)
+    sims = pricer.matching_sims(1, 45, 0, 0)
+    expected = np.zeros((11, 11), dtype=np.int64)
+    np.add.at(expected, (scores[sims, 90, 0], scores[sims, 90, 1]), 1)
+    np.testing.assert_array_equal(counts, expected)
+    assert info == {'matched': len(sims), 'top_up': 0, 'missing': 0}
+
+    # Sim 7 has its second yellow at 55, so it is a 0-1 reds state from then on only
+    assert 7 not in pricer.matching_sims(1, 54, *scores[7, 54], (0, 1))
+    assert 7 in pricer.matching_sims(1, 55, *scores[7, 55], (0, 1))
+
+    counts, info = pricer.final_counts(1, 80, 3, 3)
+    assert info['missing'] == 500 - info['matched']
+    pricer.top_up(1, 80, 3, 3, (0, 0), lambda n: np.full((n, 91, 2), 3, dtype=np.int8))
+    counts, info = pricer.final_counts(1, 80, 3, 3)
+    assert info['missing'] == 0 and counts.sum() == 500 and counts[3, 3] >= info['top_up']
+
+
+def test_in_play_clone_has_its_own_caches():
+    alg = _synthetic_alg()
+    alg.warm_lineup_states()
+    clone = core.Alg.from_worker_setup(alg.get_worker_setup())
+    for name in core.Alg.WORKER_CACHES:
+        assert getattr(clone, name) == getattr(alg, name)
+        assert getattr(clone, name) is not getattr(alg, name)
+    clone.lineup_state_cache.clear()
+    assert alg.lineup_state_cache
+
+
+def test_card_pricing_on_known_cards():
+    # sim 0: home player 1 booked twice (sent off), away player 0 straight red at 30
+    # sim 1: home player 2 booked once, after a yellow before kick-off ⇒ sent off at 70
+    # sim 2: no cards
+    cards = np.array([(0, 10, 0, 1, 0), (0, 50, 0, 1, 0), (0, 30, 1, 0, 1), (1, 70, 0, 2, 0)], dtype=core.SimulationStore.DTYPES['cards'])
+    yellow_before = (np.array([0, 0, 1, 0]), np.zeros(3, dtype=int))
+
+    distribution = core.card_count_distribution(cards, 3, max_cards=3)
+    np.testing.assert_allclose(distribution[0], [1 / 3, 1 / 3, 1 / 3, 0])
+    np.testing.assert_allclose(distribution[1], [2 / 3, 1 / 3, 0, 0])
+    np.testing.assert_allclose(distribution[2], [1 / 3, 1 / 3, 0, 1 / 3])
+
+    players = core.player_card_probabilities(cards, 3, (4, 3), yellow_before)
+    np.testing.assert_allclose(players['booked'][0], [0, 1 / 3, 1 / 3, 0])
+    np.testing.assert_allclose(players['sent_off'][0], [0, 1 / 3, 1 / 3, 0])
+    np.testing.assert_allclose(players['sent_off'][1], [1 / 3, 0, 0])
+    assert players['any_sent_off'] == 2 / 3
+
+    sent_off = core.sent_off_events(cards, (4, 3), yellow_before)
+    events = sorted(zip(sent_off['sim'].tolist(), sent_off['team'].tolist(), sent_off['minute'].tolist()))
+    assert events == [(0, 0, 50), (0, 1, 30), (1, 0, 70)]
+    assert sorted(zip(*core.sent_off_events(cards, (4, 3)).values())) == [(0, 0, 50), (0, 1, 30)]
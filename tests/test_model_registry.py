@@ -0,0 +1,45 @@
+import numpy as np
+import xgboost as xgb
+
+import core
+
+
+def _train():
+    rng = np.random.default_rng(0)
+    X = rng.random((200, 3))
+    y = X @ np.array([1.0, -2.0, 0.5])
+    booster = xgb.train({'objective': 'reg:squarederror', 'max_depth': 3}, xgb.DMatrix(X, label=y), num_boost_round=10)
+    return booster, ['a', 'b', 'c']
+
+
+def _train_deeper():
+    rng = np.random.default_rng(0)
+    X = rng.random((200, 3))
+    y = X @ np.array([1.0, -2.0, 0.5])
+    booster = xgb.train({'objective': 'reg:squarederror', 'max_depth': 5}, xgb.DMatrix(X, label=y), num_boost_round=10)
+    return booster, ['a', 'b', 'c']
+
+
+def _registry(tmp_path):
+    registry = core.ModelRegistry(str(tmp_path))
+    registry.fingerprint = lambda sql, params=None: "fixed"
+    return registry
+
+
+def test_saved_model_loads_back(tmp_path):
+    registry = _registry(tmp_path)
+    trained, columns = registry.get_or_train("test", 1, "", None, _train)
+    loaded, loaded_columns = registry.get_or_train("test", 1, "", None, _train)
+
+    assert registry.stats()['misses'] == 1 and registry.stats()['hits'] == 1
+    assert loaded_columns == columns
+    X = np.random.default_rng(1).random((20, 3)).astype(np.float32)
+    np.testing.assert_allclose(loaded.inplace_predict(X), trained.inplace_predict(X))
+    assert not [p for p in tmp_path.iterdir() if 'tmp' in p.name]
+
+
+def test_training_code_change_retrains(tmp_path):
+    registry = _registry(tmp_path)
+    registry.get_or_train("test", 1, "", None, _train)
+    registry.get_or_train("test", 1, "", None, _train_deeper)
+    assert registry.stats()['misses'] == 2